@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compares jsonschema.validate with the validator compiled from
+project_schema.json on synthetic projects of 10, 1k and 10k services.
+
+Usage::
+
+   python3 -m benchmarks.bench_validator [services ...]
+
+run from the root of the repository, so devspace is importable.
+"""
+
+import os
+import sys
+import json
+import time
+import jsonschema
+from devspace.utils.schema import compile_schema
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                           'devspace', 'schema', 'project_schema.json')
+
+
+def synthetic_project(services):
+    config = {
+        "version": "1.0",
+        "maintainer": "bench",
+        "project": {"name": "bench", "path": "/tmp/bench"},
+        "servers": {
+            "Web": {"host": "127.0.0.1", "port": 8888, "type": "alpine"},
+            "GitMirror": {"type": "alpine"},
+            "DocBuilder": {"type": "debian", "builder": ["docbook", "sphinx"]}
+        },
+        "services": {}
+    }
+    for i in range(services):
+        name = 's{}'.format(i)
+        if i % 2:
+            config['services'][name] = {
+                "Web": {"cgit_options": {"title": name, "description": "", "max-repo-count": 50}},
+                "GitMirror": {
+                    "cgit": [{"source": "http://git.example.com/cgit.cgi/{}/".format(name),
+                              "excludes": [], "targets": []}],
+                    "github": [{"source": "owner/{}-{}".format(name, j), "excludes": [], "targets": []}
+                               for j in range(10)],
+                    "gitee": [],
+                    "synchronization": {"consistency": True, "crontab": "*/5 * * * *"}
+                }
+            }
+        else:
+            config['services'][name] = {
+                "Web": {"autoindex": True},
+                "DocBuilder": {"builder": "sphinx", "source": "https://example.com/{}.git".format(name),
+                               "build": ["make html"], "publish": "./_build/html"}
+            }
+    return config
+
+
+def best_of(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(sizes):
+    with open(SCHEMA_FILE, 'r', encoding='utf-8') as f:
+        schema = json.load(f)
+    namespace = {}
+    exec(compile(compile_schema(schema), 'project_validator', 'exec'), namespace)
+    validate = namespace['validate']
+
+    print("%10s %16s %16s %8s" % ('services', 'jsonschema (ms)', 'compiled (ms)', 'speedup'))
+    for size in sizes:
+        config = synthetic_project(size)
+        assert not validate(config)
+        repeat = 5 if size <= 1000 else 2
+        reference = best_of(lambda: jsonschema.validate(instance=config, schema=schema), repeat)
+        compiled = best_of(lambda: validate(config), repeat)
+        print("%10d %16.2f %16.2f %7.1fx" % (size, reference * 1000, compiled * 1000, reference / compiled))
+
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10, 1000, 10000])
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Loads the Web server with concurrent keep-alive GET requests and reports the
+requests per second and the latency percentiles, to compare the proxy and
+fastcgi cgit modes (servers.Web.cgit_mode) on the same pages.
+
+Render and start Web in one mode, run the benchmark, then switch the mode,
+render Web again, restart it and run the benchmark again.
+
+Usage::
+
+   python3 benchmarks/http_load.py [-c concurrency] [-d seconds] url [url ...]
+
+   python3 benchmarks/http_load.py -c 16 -d 30 http://localhost:8888/yocto/ \
+       http://localhost:8888/yocto/poky/log/
+"""
+
+import sys
+import time
+import argparse
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+
+def worker(urls, deadline, latencies, errors, index):
+    parts = [urlsplit(url) for url in urls]
+    connection = None
+    count = 0
+    while time.monotonic() < deadline:
+        part = parts[(index + count) % len(parts)]
+        count += 1
+        path = part.path or '/'
+        if part.query:
+            path += '?' + part.query
+        start = time.monotonic()
+        try:
+            if connection is None:
+                connection = http.client.HTTPConnection(part.hostname, part.port or 80, timeout=30)
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            if connection is not None:
+                connection.close()
+            connection = None
+            continue
+        latencies.append(time.monotonic() - start)
+    if connection is not None:
+        connection.close()
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test of the Web server")
+    parser.add_argument('-c', '--concurrency', type=int, default=8, help="concurrent connections (default: 8)")
+    parser.add_argument('-d', '--duration', type=float, default=10, help="seconds of load (default: 10)")
+    parser.add_argument('urls', nargs='+', help="pages requested in turn by each connection")
+    args = parser.parse_args()
+
+    # list.append is atomic, the workers share the lists
+    latencies = []
+    errors = []
+    start = time.monotonic()
+    deadline = start + args.duration
+    threads = [threading.Thread(target=worker, args=(args.urls, deadline, latencies, errors, index))
+               for index in range(args.concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    if not latencies:
+        print("No successful request, {} errors: {}".format(len(errors), sorted(set(map(str, errors)))))
+        return 1
+    latencies.sort()
+    print("{:>10} {:>10} {:>10} {:>10} {:>10} {:>8}".format(
+        'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'errors'))
+    print("{:>10} {:>10.1f} {:>10.2f} {:>10.2f} {:>10.2f} {:>8}".format(
+        len(latencies), len(latencies) / elapsed, percentile(latencies, 0.5) * 1000,
+        percentile(latencies, 0.9) * 1000, percentile(latencies, 0.99) * 1000, len(errors)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,55 +2,188 @@
 # -*- coding: utf-8 -*-
 
 import sys
+import os
+import json
+import time
 import optparse
 import inspect
-import pkg_resources
+from importlib import import_module
+from importlib.util import find_spec
+from pkgutil import iter_modules
 
 import devspace
 from devspace.commands import DevSpaceCommand
 from devspace.exceptions import UsageError
 from devspace.settings import Settings
-from devspace.utils.misc import walk_modules, inside_project, get_project_settings
+from devspace.utils.misc import inside_project, get_project_settings
 # from scrapy.utils.python import garbage_collect
 
 
 def _iter_command_classes(module_name):
-    for module in walk_modules(module_name):
-        for obj in vars(module).values():
-            if inspect.isclass(obj) and \
-                    issubclass(obj, DevSpaceCommand) and \
-                    obj.__module__ == module.__name__ and \
-                    not obj == DevSpaceCommand:
-                yield obj
-
-
-def _get_commands_from_module(module, inproject):
-    d = {}
-    for cmd in _iter_command_classes(module):
-        if inproject or not cmd.requires_project:
-            cmdname = cmd.__module__.split('.')[-1]
-            d[cmdname] = cmd()
-    return d
-
-
-def _get_commands_from_entry_points(inproject, group='devspace.commands'):
-    cmds = {}
-    for entry_point in pkg_resources.iter_entry_points(group):
-        obj = entry_point.load()
-        if inspect.isclass(obj):
-            cmds[entry_point.name] = obj()
+    module = import_module(module_name)
+    for obj in vars(module).values():
+        if inspect.isclass(obj) and \
+                issubclass(obj, DevSpaceCommand) and \
+                obj.__module__ == module.__name__ and \
+                not obj == DevSpaceCommand:
+            yield obj
+
+
+def _iter_command_modules(module_name):
+    """Yields (command name, module name, file stamp) for each module of the
+    package *module_name* without importing them.
+    """
+    package = import_module(module_name)
+    for _, subpath, ispkg in iter_modules(package.__path__):
+        fullpath = module_name + '.' + subpath
+        if ispkg:
+            yield from _iter_command_modules(fullpath)
+            continue
+        origin = find_spec(fullpath).origin
+        st = os.stat(origin)
+        yield subpath, fullpath, '{}:{}:{}'.format(origin, st.st_size, st.st_mtime_ns)
+
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        return []
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return eps.select(group=group)
+    return eps.get(group, [])
+
+
+def _load_entry_point(name, value):
+    module_name, _, attrs = value.split('[')[0].strip().partition(':')
+    obj = import_module(module_name.strip())
+    for attr in attrs.strip().split('.') if attrs else []:
+        obj = getattr(obj, attr)
+    if not inspect.isclass(obj):
+        raise Exception("Invalid entry point %s" % name)
+    return obj
+
+
+def _sys_path_stamp():
+    """Changes whenever a distribution is installed or removed on sys.path"""
+    stamps = []
+    for path in sys.path:
+        try:
+            stamps.append('{}:{}'.format(path, os.stat(path).st_mtime_ns))
+        except (OSError, ValueError):
+            continue
+    return '|'.join(stamps)
+
+
+class CommandRegistry:
+    """
+    Lists the available commands from an index cached in COMMANDS_INDEX, so
+    only the module of the command being run is imported. An index entry is
+    refreshed when its module file or entry point changes.
+    """
+
+    def __init__(self, settings, group='devspace.commands'):
+        self.settings = settings
+        self.group = group
+        self.index_file = settings['COMMANDS_INDEX']
+        self.cached = self._read_index()
+        self.index = {}
+        self.entries = {}
+        self.scan()
+
+    def _read_index(self):
+        try:
+            with open(self.index_file, 'r', encoding="utf-8") as f:
+                index = json.load(f)
+        except (TypeError, OSError, ValueError):
+            return {}
+        if index.get('version') != devspace.__version__:
+            return {}
+        return index.get('sources', {})
+
+    def _write_index(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(self.index_file, os.getpid())
+            with open(tmp_file, 'w', encoding="utf-8") as f:
+                json.dump({'version': devspace.__version__, 'sources': self.index}, f, indent=2)
+            os.replace(tmp_file, self.index_file)
+        except (TypeError, OSError):
+            pass  # the index is only a cache
+
+    def _entry(self, source, stamp, load):
+        entry = self.cached.get(source)
+        if entry is None or entry['stamp'] != stamp:
+            cmdcls = load()
+            entry = {'stamp': stamp, 'command': None}
+            if cmdcls is not None:
+                entry.update(command=True, requires_project=cmdcls.requires_project,
+                             short_desc=cmdcls().short_desc())
+        self.index[source] = entry
+        return entry
+
+    def _scan_module(self, module_name):
+        for cmdname, fullpath, stamp in _iter_command_modules(module_name):
+            entry = self._entry(fullpath, stamp,
+                                lambda: next(_iter_command_classes(fullpath), None))
+            if entry['command']:
+                self.entries[cmdname] = dict(entry, module=fullpath)
+
+    def _scan_entry_points(self):
+        # importlib.metadata is slow to import, only read entry points when sys.path changed
+        stamp = _sys_path_stamp()
+        cached = self.cached.get(self.group)
+        if cached and cached['stamp'] == stamp:
+            entry_points = cached['entry_points']
         else:
-            raise Exception("Invalid entry point %s" % entry_point.name)
-    return cmds
+            entry_points = [[ep.name, ep.value] for ep in _iter_entry_points(self.group)]
+        self.index[self.group] = {'stamp': stamp, 'entry_points': entry_points}
+        for name, value in entry_points:
+            entry = self._entry('{}:{}={}'.format(self.group, name, value), value,
+                                lambda: _load_entry_point(name, value))
+            self.entries[name] = dict(entry, entry_point=value)
+
+    def scan(self):
+        self._scan_module('devspace.commands')
+        self._scan_entry_points()
+        cmds_module = self.settings['COMMANDS_MODULE']
+        if cmds_module:
+            self._scan_module(cmds_module)
+        if self.index != self.cached:
+            self._write_index()
 
+    def commands(self, inproject):
+        """Command name to short description of the commands available"""
+        return {cmdname: entry['short_desc'] for cmdname, entry in self.entries.items()
+                if inproject or entry.get('entry_point') or not entry['requires_project']}
 
-def _get_commands_dict(settings, inproject):
-    cmds = _get_commands_from_module('devspace.commands', inproject)
-    cmds.update(_get_commands_from_entry_points(inproject))
-    cmds_module = settings['COMMANDS_MODULE']
-    if cmds_module:
-        cmds.update(_get_commands_from_module(cmds_module, inproject))
-    return cmds
+    def load(self, cmdname):
+        entry = self.entries[cmdname]
+        if entry.get('entry_point'):
+            return _load_entry_point(cmdname, entry['entry_point'])()
+        return next(_iter_command_classes(entry['module']))()
+
+
+class StartupProfile:
+    """Time spent in each startup phase, printed with --startup-profile"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.phases = []
+        self.last = self.start = time.perf_counter()
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def report(self):
+        if not self.enabled:
+            return
+        for phase, elapsed in self.phases:
+            sys.stderr.write("  %-13s %8.2f ms\n" % (phase, elapsed * 1000))
+        sys.stderr.write("  %-13s %8.2f ms\n" % ('total', (self.last - self.start) * 1000))
 
 
 def _pop_command_name(argv):
@@ -69,14 +202,13 @@ def _print_header(settings, inproject):
         print("Devspace %s - no active project\n" % devspace.__version__)
 
 
-def _print_commands(settings, inproject):
+def _print_commands(settings, inproject, cmds):
     _print_header(settings, inproject)
     print("Usage:")
     print("  devspace <command> [options] [args]\n")
     print("Available commands:")
-    cmds = _get_commands_dict(settings, inproject)
-    for cmdname, cmdclass in sorted(cmds.items()):
-        print("  %-13s %s" % (cmdname, cmdclass.short_desc()))
+    for cmdname, short_desc in sorted(cmds.items()):
+        print("  %-13s %s" % (cmdname, short_desc))
     if not inproject:
         print()
         print("  [ more ]      More commands available when run from project directory")
@@ -109,25 +241,35 @@ def execute(argv=None, settings=None):
     if argv is None:
         argv = sys.argv
 
+    profile = StartupProfile('--startup-profile' in argv)
+    if profile.enabled:
+        argv = [arg for arg in argv if arg != '--startup-profile']
+
     if settings is None:
         settings = Settings()
+    profile.mark('settings')
 
     inproject = inside_project()
     if inproject:
         if not get_project_settings(settings):
             sys.exit(2)
-    cmds = _get_commands_dict(settings, inproject)
+    profile.mark('project')
+    registry = CommandRegistry(settings)
+    cmds = registry.commands(inproject)
+    profile.mark('commands')
     cmdname = _pop_command_name(argv)
     parser = optparse.OptionParser(formatter=optparse.TitledHelpFormatter(),
         conflict_handler='resolve')
     if not cmdname:
-        _print_commands(settings, inproject)
+        _print_commands(settings, inproject, cmds)
+        profile.report()
         sys.exit(0)
     elif cmdname not in cmds:
         _print_unknown_command(settings, cmdname, inproject)
         sys.exit(2)
 
-    cmd = cmds[cmdname]
+    cmd = registry.load(cmdname)
+    profile.mark('load command')
     parser.usage = "devspace %s %s" % (cmdname, cmd.syntax())
     parser.description = cmd.long_desc()
     cmd.settings = settings
@@ -135,6 +277,8 @@ def execute(argv=None, settings=None):
     opts, args = parser.parse_args(args=argv[1:])
     _run_print_help(parser, cmd.process_options, args, opts)
     _run_print_help(parser, _run_command, cmd, args, opts)
+    profile.mark('run')
+    profile.report()
     sys.exit(cmd.exitcode)
 
 
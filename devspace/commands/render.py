@@ -5,20 +5,28 @@ import os
 import devspace
 from devspace.commands import DevSpaceCommand
 from devspace.exceptions import UsageError
-from devspace.utils.misc import walk_modules
+from devspace.utils.misc import walk_modules, COPY_MODES
 from devspace.servers import DevSpaceServer
 import inspect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 
-def _get_server_from_module(module_name, server_name, project_setting):
+def _get_servers_from_module(module_name):
+    servers = {}
     for module in walk_modules(module_name):
         for obj in vars(module).values():
             if inspect.isclass(obj) and \
                     issubclass(obj, DevSpaceServer) and \
                     obj.__module__ == module.__name__ and \
-                    not obj == DevSpaceServer and \
-                    server_name == obj.type:
-                return obj(project_setting)
+                    not obj == DevSpaceServer:
+                servers[obj.type] = obj
+    return servers
+
+
+def _render_server(server_cls, project_setting, targets=None, changed=False):
+    server = server_cls(project_setting, targets)
+    server.render(changed)
+    return server
 
 
 class Command(DevSpaceCommand):
@@ -37,32 +45,86 @@ class Command(DevSpaceCommand):
                           help="Render all servers")
         parser.add_option("--server", dest="server_name",
                           help="Render server by its name")
+        parser.add_option("--service", dest="services", action="append", default=None, metavar="NAME",
+                          help="only render the outputs of this service, can be repeated. "
+                               "Outputs shared by all services are still rendered")
+        parser.add_option("--changed", dest="changed", action="store_true",
+                          help="only render the services whose settings changed since the last render, "
+                               "and the outputs shared by all services")
+        parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None, metavar="N",
+                          help="number of servers rendered concurrently with --all (default: one per server)")
+        parser.add_option("--copy-mode", dest="copy_mode", type="choice", choices=COPY_MODES, metavar="MODE",
+                          help="how read-only assets are copied: {} (default: {})".format(
+                              ', '.join(COPY_MODES), self.settings['COPY_MODE']))
+        parser.add_option("--update-apps", dest="update_apps", action="store_true",
+                          help="fast-forward the server apps already installed to their latest version")
         parser.add_option("--host", dest="host", action="store_true",
                           help="Render project file host ip")
 
+    def process_options(self, args, opts):
+        DevSpaceCommand.process_options(self, args, opts)
+        if opts.jobs is not None and opts.jobs < 1:
+            raise UsageError("--jobs must be a positive number", print_help=False)
+        if opts.copy_mode:
+            self.settings.set('COPY_MODE', opts.copy_mode)
+        if opts.update_apps:
+            self.settings.set('UPDATE_APPS', True)
+
     def run(self, args, opts):
         if len(args) > 0:
             raise UsageError()
 
-        if opts.render_all:
-            print("render all server")
-            return
-
         if opts.host:
             return
 
-        print("render_server")
-        # print(self.settings.attributes)
-        server_name = opts.server_name
         servers = self.settings.get("servers")
-        if not servers or server_name not in servers.keys():
+        if not servers:
             print("No servers found please check your project configuration file")
             self.exitcode = 1
             return
-        server = _get_server_from_module('devspace.servers', server_name, self.settings)
-        server.render()
-        server.update_docker_compose()
+        if opts.services:
+            unknown = [name for name in opts.services if name not in (self.settings.get("services") or {})]
+            if unknown:
+                print("Unknown services: {}".format(', '.join(unknown)))
+                self.exitcode = 1
+                return
+        server_classes = _get_servers_from_module('devspace.servers')
+
+        if opts.render_all:
+            print("render all server")
+            server_names = [name for name in servers.keys() if name in server_classes]
+            for server_name in servers.keys():
+                if server_name not in server_classes:
+                    print("{}: not supported, skipped".format(server_name))
+        else:
+            print("render_server")
+            if opts.server_name not in servers.keys() or opts.server_name not in server_classes:
+                print("No servers found please check your project configuration file")
+                self.exitcode = 1
+                return
+            server_names = [opts.server_name]
+
+        rendered = self.render_servers(server_names, server_classes, opts.jobs or len(server_names), opts.services,
+                                       opts.changed)
+        # docker-compose.yaml is shared by all servers, update it in configuration order
+        for server_name in server_names:
+            if server_name in rendered:
+                rendered[server_name].update_docker_compose()
 
+    def render_servers(self, server_names, server_classes, jobs, targets=None, changed=False):
+        rendered = {}
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {executor.submit(_render_server, server_classes[server_name], self.settings, targets, changed):
+                       server_name
+                       for server_name in server_names}
+            for future in as_completed(futures):
+                server_name = futures[future]
+                try:
+                    rendered[server_name] = future.result()
+                except Exception as e:
+                    print("Error: render {} failed: {}".format(server_name, e))
+                    self.exitcode = 1
+        return rendered
 
     @property
     def templates_dir(self):
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+from devspace.commands import DevSpaceCommand
+from devspace.exceptions import UsageError
+from devspace.utils.database import database_file
+from devspace.runners.mirror import MirrorRunner, write_agefiles
+from devspace.runners.maintain import MaintenanceRunner
+from devspace.runners.docs import DocsRunner, summary_table, load_pipelines, database_file as docs_database_file
+
+
+class Command(DevSpaceCommand):
+
+    requires_project = True
+
+    tasks = {
+        'mirror': "mirror the repositories of the GitMirror services",
+        'maintain': "repack and write the commit-graph of the GitMirror mirrors updated since their last maintenance",
+        'agefile': "write the cgit agefile of all the GitMirror mirrors",
+        'docs': "check out, build and publish the documentation of the DocBuilder services",
+    }
+
+    def syntax(self):
+        return "<task> [service ...] [Options]"
+
+    def short_desc(self):
+        return "Run a server task"
+
+    def long_desc(self):
+        return "Run a server task on all its services, or on the given ones. Tasks: {}".format(
+            ', '.join('{} ({})'.format(task, desc) for task, desc in self.tasks.items()))
+
+    def add_options(self, parser):
+        DevSpaceCommand.add_options(self, parser)
+        parser.add_option("-j", "--jobs", dest="jobs", type="int", default=None, metavar="N",
+                          help="number of concurrent jobs (default: %s for mirror, %s for maintain, "
+                               "one per core for docs)" % (self.settings['MIRROR_JOBS'],
+                                                           self.settings['MAINTAIN_JOBS']))
+        parser.add_option("--step-jobs", dest="step_jobs", type="int", default=None, metavar="N",
+                          help="number of concurrent build steps of a docs pipeline (default: one per core)")
+        parser.add_option("--host-jobs", dest="host_jobs", type="int", default=None, metavar="N",
+                          help="number of concurrent jobs on the same upstream host "
+                               "(default: %s)" % self.settings['MIRROR_HOST_JOBS'])
+        parser.add_option("--retries", dest="retries", type="int", default=None, metavar="N",
+                          help="retries of a failed fetch (default: %s)" % self.settings['MIRROR_RETRIES'])
+        parser.add_option("--force", dest="force", action="store_true",
+                          help="mirror: fetch all the repositories, even the ones whose upstream refs didn't "
+                               "change. maintain: maintain all the mirrors, even the ones not updated. "
+                               "docs: build even when the source and the build settings didn't change")
+        parser.add_option("--adaptive", dest="adaptive", action="store_true", default=None,
+                          help="only check the repositories due, at intervals adapted to how often they change")
+        parser.add_option("--maintain", dest="maintain", action="store_true",
+                          help="run the maintenance of the mirrors updated once mirror is done")
+        parser.add_option("--budget", dest="budget", type="float", default=None, metavar="SECONDS",
+                          help="time budget of maintain, the mirrors beyond are deferred to the next run "
+                               "(default: %s, 0 for no limit)" % self.settings['MAINTAIN_BUDGET'])
+
+    def process_options(self, args, opts):
+        DevSpaceCommand.process_options(self, args, opts)
+        for name in ('jobs', 'step_jobs', 'host_jobs'):
+            if getattr(opts, name) is not None and getattr(opts, name) < 1:
+                raise UsageError("--{} must be a positive number".format(name.replace('_', '-')), print_help=False)
+        if opts.retries is not None and opts.retries < 0:
+            raise UsageError("--retries can't be negative", print_help=False)
+        if opts.budget is not None and opts.budget < 0:
+            raise UsageError("--budget can't be negative", print_help=False)
+
+    def run(self, args, opts):
+        if not args or args[0] not in self.tasks:
+            raise UsageError()
+        getattr(self, 'run_' + args[0])(args[1:], opts)
+
+    def server_services(self, server_name, service_names):
+        """The services of *server_name*, limited to *service_names* when given"""
+        services = [service_name for service_name, service in (self.settings.get('services') or {}).items()
+                    if server_name in service]
+        unknown = [service_name for service_name in service_names if service_name not in services]
+        if unknown:
+            print("Not {} services: {}".format(server_name, ', '.join(unknown)))
+            self.exitcode = 1
+            return []
+        return service_names or services
+
+    def mirror_services(self, service_names):
+        service_names = self.server_services('GitMirror', service_names)
+        missing = [service_name for service_name in service_names
+                   if not os.path.isfile(database_file(self.settings, service_name))]
+        if missing:
+            print("No database for {}, please render GitMirror first".format(', '.join(missing)))
+            self.exitcode = 1
+            return []
+        return service_names
+
+    def print_stats(self, stats):
+        for service_stats in stats.values():
+            print(service_stats.summary())
+            if service_stats.failed:
+                self.exitcode = 1
+
+    def run_mirror(self, service_names, opts):
+        service_names = self.mirror_services(service_names)
+        if not service_names:
+            return
+        runner = MirrorRunner(self.settings, opts.jobs, opts.host_jobs, opts.retries, opts.force, opts.adaptive)
+        self.print_stats(runner.run(service_names))
+        if opts.maintain:
+            self.print_stats(MaintenanceRunner(self.settings, budget=opts.budget).run(service_names))
+
+    def run_maintain(self, service_names, opts):
+        service_names = self.mirror_services(service_names)
+        if not service_names:
+            return
+        self.print_stats(MaintenanceRunner(self.settings, opts.jobs, opts.budget, opts.force).run(service_names))
+
+    def run_agefile(self, service_names, opts):
+        service_names = self.server_services('GitMirror', service_names)
+        if not service_names:
+            return
+        self.print_stats(write_agefiles(self.settings, service_names, opts.jobs))
+
+    def run_docs(self, service_names, opts):
+        service_names = self.server_services('DocBuilder', service_names)
+        if not service_names:
+            return
+        if not os.path.isfile(docs_database_file(self.settings)):
+            print("No database.json, please render DocBuilder first")
+            self.exitcode = 1
+            return
+        pipelines = load_pipelines(self.settings)
+        missing = [service_name for service_name in service_names if service_name not in pipelines]
+        if missing:
+            print("{} not in database.json, please render DocBuilder".format(', '.join(missing)))
+            self.exitcode = 1
+            service_names = [service_name for service_name in service_names if service_name in pipelines]
+            if not service_names:
+                return
+        results = DocsRunner(self.settings, opts.jobs, opts.step_jobs, opts.force).run(service_names)
+        print(summary_table(results))
+        if any(result.failed for result in results.values()):
+            self.exitcode = 1
@@ -19,3 +19,12 @@ class ConfigurationError(Exception):
 
     def __str__(self):
         return self.msg
+
+
+# Runners
+class GitError(Exception):
+    """A git command failed, the message is its error output"""
+
+
+class BuildError(Exception):
+    """A step of a documentation pipeline failed"""
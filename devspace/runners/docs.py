@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+import json
+import signal
+import time
+import subprocess
+import threading
+from os.path import join, isdir, normpath
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from devspace.exceptions import GitError, BuildError
+from devspace.utils.git import run_git
+from devspace.utils.misc import copytree, file_lock, lock_file
+from devspace.utils.manifest import hash_inputs
+from devspace.utils.precompress import precompress, load_record, is_owned, SUFFIXES
+
+# the stages of a pipeline, in order
+STAGES = ('checkout', 'build', 'publish')
+
+Step = namedtuple('Step', ['name', 'run', 'cwd', 'depends_on'])
+
+
+def available_cores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not on Linux
+        return os.cpu_count() or 1
+
+
+def database_file(settings):
+    return join(settings['project']['path'], 'servers', 'DocBuilder', 'apps', 'database.json')
+
+
+def load_pipelines(settings):
+    """The services of database.json, as rendered for the DocBuilder container"""
+    with open(database_file(settings), 'r', encoding='utf8') as f:
+        return json.load(f)
+
+
+def kill_session(process):
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:  # already done
+        pass
+
+
+def is_step_list(build):
+    return any(isinstance(step, dict) for step in build)
+
+
+def build_steps(build):
+    """
+    The steps of a *build* list made of step objects, each one after the
+    steps it depends on, otherwise in the order they were declared. Raise
+    BuildError when a step depends on an unknown step, or the dependencies
+    make a cycle.
+    """
+    steps = OrderedDict()
+    for step in build:
+        if not isinstance(step, dict):
+            raise BuildError("build mixes commands and steps")
+        if step['name'] in steps:
+            raise BuildError("duplicate step {}".format(step['name']))
+        steps[step['name']] = Step(step['name'], step['run'], step.get('cwd', ''), tuple(step.get('depends_on', [])))
+    for step in steps.values():
+        unknown = [name for name in step.depends_on if name not in steps]
+        if unknown:
+            raise BuildError("step {} depends on unknown {}".format(step.name, ', '.join(unknown)))
+    ordered = OrderedDict()
+    while len(ordered) < len(steps):
+        ready = [name for name, step in steps.items()
+                 if name not in ordered and all(dep in ordered for dep in step.depends_on)]
+        if not ready:
+            raise BuildError("steps {} depend on each other".format(
+                ', '.join(sorted(name for name in steps if name not in ordered))))
+        for name in ready:
+            ordered[name] = steps[name]
+    return ordered
+
+
+def sequential_build(steps):
+    """The commands running *steps* one after the other, as a plain build list"""
+    commands = []
+    cwd = '.'
+    for step in steps.values():
+        step_cwd = normpath(step.cwd or '.')
+        if step_cwd != cwd:
+            commands.append('cd {}'.format(os.path.relpath(step_cwd, cwd).replace(os.sep, '/')))
+            cwd = step_cwd
+        commands.append(step.run)
+    return commands
+
+
+def build_config(pipeline):
+    """Digest of the settings of *pipeline* that change what it builds and publishes"""
+    return hash_inputs(**{key: pipeline.get(key) for key in ('builder', 'build', 'steps', 'publish', 'needWeb')})
+
+
+def precompress_record(settings, service_name):
+    return join(settings['PRECOMPRESS_RECORDS'], 'services', service_name + '.json')
+
+
+def sync_tree(src, dst, owned=None):
+    """
+    Copy *src* into *dst*, and remove what *dst* has that *src* doesn't, but
+    the precompressed siblings in *owned* of the files still published
+    """
+    owned = owned or {}
+    copytree(src, dst)
+    for root, dirs, files in os.walk(dst, topdown=False):
+        src_root = join(src, os.path.relpath(root, dst))
+        for name in files:
+            if name.endswith(SUFFIXES) and os.path.isfile(join(src_root, name.rsplit('.', 1)[0])) and \
+                    is_owned(normpath(join(root, name)), owned):
+                continue
+            if not os.path.isfile(join(src_root, name)):
+                os.remove(join(root, name))
+        for name in dirs:
+            if not isdir(join(src_root, name)):
+                os.rmdir(join(root, name))
+
+
+class PipelineResult:
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.status = 'pending'
+        self.error = ''
+        self.durations = OrderedDict()
+        # (status, duration) of each build step
+        self.steps = OrderedDict()
+
+    @property
+    def failed(self):
+        return self.status == 'failed'
+
+    def description(self):
+        return "{}, {}".format(self.status, self.error) if self.error else self.status
+
+    def summary(self):
+        return "{}: {}".format(self.service_name, self.description())
+
+
+class DocsRunner:
+    """
+    Runs the checkout, build and publish pipelines of the DocBuilder
+    services on the host, from the database.json rendered for the container.
+
+    The pipelines run concurrently, DOCS_JOBS of them at a time or one per
+    core. The source of a service is checked out in
+    SHARED_DATA/<service_name>/source, its build commands run there in one
+    shell, so a ``cd`` applies to the following commands, and the publish
+    directory, relative to the source, is copied to
+    SHARED_WEB/services/<service_name> for the services served by Web.
+
+    The build can also be a list of named steps, each with its command, the
+    directory it runs in and the steps it depends on, rendered as the steps
+    of the service in database.json. The steps whose
+    dependencies are built run concurrently, DOCS_STEP_JOBS of them at a time
+    or one per core; the steps depending on a failed one are skipped.
+
+    The source commit and the digest of the build settings of the last
+    successful build are kept in SHARED_DATA/<service_name>/build.json: when
+    neither changed, the build and the publish are skipped, unless *force* is
+    set. Sphinx builds keep their doctrees in SHARED_DATA/<service_name>/doctrees
+    and get DOCS_SPHINX_OPTS, parallel reading by default.
+
+    The checkout, the build and each build step are given DOCS_TIMEOUT
+    seconds. The output of each pipeline is printed as it comes, prefixed
+    with the name of its service.
+    """
+
+    def __init__(self, settings, jobs=None, step_jobs=None, force=False):
+        self.settings = settings
+        self.force = force
+        self.sphinx_opts = settings.get('DOCS_SPHINX_OPTS', '')
+        self.jobs = jobs or int(settings.get('DOCS_JOBS', 0)) or available_cores()
+        self.step_jobs = step_jobs or int(settings.get('DOCS_STEP_JOBS', 0)) or available_cores()
+        self.timeout = int(settings.get('DOCS_TIMEOUT', 0)) or None
+        self.print_lock = threading.Lock()
+        self.width = 0
+
+    def output(self, service_name, line):
+        with self.print_lock:
+            print("{} | {}".format(service_name.ljust(self.width), line.rstrip('\n')))
+            sys.stdout.flush()
+
+    def source_dir(self, service_name):
+        return join(self.settings['SHARED_DATA'], service_name, 'source')
+
+    def state_file(self, service_name):
+        return join(self.settings['SHARED_DATA'], service_name, 'build.json')
+
+    def build_state(self, service_name, pipeline):
+        return {'commit': run_git("rev-parse", "HEAD", cwd=self.source_dir(service_name)).strip(),
+                'config': build_config(pipeline)}
+
+    def is_fresh(self, service_name, pipeline, state):
+        """Whether the last build of *service_name* was made from *state* and is still published"""
+        if self.force:
+            return False
+        if pipeline.get('needWeb') and pipeline.get('publish') and \
+                not isdir(join(self.settings['SHARED_WEB'], 'services', service_name)):
+            return False
+        try:
+            with open(self.state_file(service_name), 'r', encoding='utf8') as f:
+                return json.load(f) == state
+        except (OSError, ValueError):
+            return False
+
+    def save_state(self, service_name, state):
+        tmp_file = self.state_file(service_name) + '.tmp'
+        with open(tmp_file, 'w', encoding='utf8') as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.state_file(service_name))
+
+    def build_env(self, service_name, pipeline):
+        """The environment of the build commands"""
+        env = dict(os.environ)
+        if pipeline.get('builder') == 'sphinx':
+            # the doctrees outlive a new clone of the source, sphinx only reads the documents changed
+            doctrees = join(os.path.abspath(self.settings['SHARED_DATA']), service_name, 'doctrees')
+            env['SPHINXOPTS'] = ' '.join(opts for opts in (env.get('SPHINXOPTS', ''), self.sphinx_opts,
+                                                           '-d ' + doctrees) if opts)
+        return env
+
+    def source_path(self, service_name, path):
+        """*path* relative to the source of *service_name*, raise BuildError when it's outside"""
+        source_dir = normpath(self.source_dir(service_name))
+        full_path = normpath(join(source_dir, path))
+        if full_path != source_dir and not full_path.startswith(source_dir + os.sep):
+            raise BuildError("{} is outside the source".format(path))
+        return full_path
+
+    def checkout(self, result, pipeline):
+        """Clone the source of the service, or update it to the latest commit of its default branch"""
+        service_name = result.service_name
+        source_dir = self.source_dir(service_name)
+        if not isdir(source_dir):
+            os.makedirs(os.path.dirname(source_dir), exist_ok=True)
+            self.output(service_name, "clone {}".format(pipeline['source']))
+            run_git("clone", "--quiet", pipeline['source'], source_dir, timeout=self.timeout)
+            return
+        run_git("fetch", "--quiet", "origin", "HEAD", cwd=source_dir, timeout=self.timeout)
+        run_git("checkout", "--quiet", "--force", "FETCH_HEAD", cwd=source_dir)
+        self.output(service_name, "checkout {}".format(
+            run_git("rev-parse", "--short", "HEAD", cwd=source_dir).strip()))
+
+    def shell(self, prefix, script, cwd, env=None):
+        """Run *script* with sh -e in *cwd*, streaming its output, killed with its commands after DOCS_TIMEOUT"""
+        # in a session of its own, the commands it started are killed with it
+        process = subprocess.Popen(["sh", "-e", "-c", script], cwd=cwd, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True, errors='replace', start_new_session=True)
+        timer = threading.Timer(self.timeout, kill_session, (process,)) if self.timeout else None
+        if timer:
+            timer.start()
+        try:
+            with process:
+                for line in process.stdout:
+                    self.output(prefix, line)
+        finally:
+            if timer:
+                timer.cancel()
+        if timer and process.returncode == -signal.SIGKILL:
+            raise BuildError("timed out after {} seconds".format(self.timeout))
+        if process.returncode != 0:
+            raise BuildError("exited with {}".format(process.returncode))
+
+    def build(self, result, pipeline):
+        env = self.build_env(result.service_name, pipeline)
+        if pipeline.get('steps'):
+            self.run_steps(result, build_steps(pipeline['steps']), env)
+        elif pipeline.get('build'):
+            self.shell(result.service_name, '\n'.join(pipeline['build']), self.source_dir(result.service_name), env)
+
+    def build_step(self, result, step, env):
+        start = time.monotonic()
+        try:
+            self.shell('{}/{}'.format(result.service_name, step.name), step.run,
+                       self.source_path(result.service_name, step.cwd), env)
+        finally:
+            result.steps[step.name] = ('running', time.monotonic() - start)
+
+    def run_steps(self, result, steps, env):
+        """Run the *steps* whose dependencies are built, until all are built or skipped"""
+        pending = OrderedDict(steps)
+        built = set()
+        stopped = set()
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.step_jobs) as executor:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if any(dep in stopped for dep in step.depends_on):
+                        del pending[name]
+                        stopped.add(name)
+                        result.steps[name] = ('skipped', 0.0)
+                    elif all(dep in built for dep in step.depends_on) and len(running) < self.step_jobs:
+                        del pending[name]
+                        running[executor.submit(self.build_step, result, step, env)] = name
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    duration = result.steps[name][1]
+                    try:
+                        future.result()
+                    except (BuildError, OSError) as e:
+                        self.output(result.service_name, "step {} failed: {}".format(name, e))
+                        stopped.add(name)
+                        result.steps[name] = ('failed', duration)
+                    else:
+                        built.add(name)
+                        result.steps[name] = ('built', duration)
+        # the declaration order
+        for name in steps:
+            result.steps.move_to_end(name)
+        failed = [name for name, (status, _) in result.steps.items() if status == 'failed']
+        if failed:
+            raise BuildError("steps {} failed".format(', '.join(failed)))
+
+    def publish(self, result, pipeline):
+        if not pipeline.get('needWeb') or not pipeline.get('publish'):
+            return
+        publish_dir = self.source_path(result.service_name, pipeline['publish'])
+        if not isdir(publish_dir):
+            raise BuildError("nothing to publish in {}".format(pipeline['publish']))
+        www_dir = join(self.settings['SHARED_WEB'], 'services', result.service_name)
+        record = precompress_record(self.settings, result.service_name)
+        sync_tree(publish_dir, www_dir, load_record(record, normpath(www_dir)))
+        if self.settings.get_bool('PRECOMPRESS'):
+            precompress(www_dir, record, int(self.settings.get('PRECOMPRESS_JOBS', 0)) or available_cores())
+
+    def run_pipeline(self, service_name, pipeline):
+        result = PipelineResult(service_name)
+        with file_lock(lock_file(self.settings, service_name + '.docs'), blocking=False) as locked:
+            if not locked:
+                result.status = 'skipped'
+                result.error = "already being built"
+                return result
+            state = None
+            for stage in STAGES:
+                start = time.monotonic()
+                try:
+                    getattr(self, stage)(result, pipeline)
+                    if stage == 'checkout':
+                        state = self.build_state(service_name, pipeline)
+                        if self.is_fresh(service_name, pipeline, state):
+                            result.status = 'up to date'
+                            return result
+                except (GitError, BuildError, OSError) as e:
+                    result.status = 'failed'
+                    result.error = "{} failed: {}".format(stage, e)
+                    self.output(service_name, result.error)
+                    return result
+                finally:
+                    result.durations[stage] = time.monotonic() - start
+            self.save_state(service_name, state)
+        result.status = 'built'
+        return result
+
+    def run(self, service_names):
+        """Run the pipelines of *service_names*, return their PipelineResult"""
+        pipelines = load_pipelines(self.settings)
+        results = OrderedDict()
+        for service_name in service_names:
+            if not pipelines[service_name].get('source'):
+                results[service_name] = PipelineResult(service_name)
+                results[service_name].status = 'skipped'
+                results[service_name].error = "no source"
+        self.width = max([0] + [len(service_name) for service_name in service_names])
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = [executor.submit(self.run_pipeline, service_name, pipelines[service_name])
+                       for service_name in service_names if service_name not in results]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result.service_name] = result
+        return OrderedDict((service_name, results[service_name]) for service_name in service_names)
+
+
+def summary_table(results):
+    """The durations of the pipelines, one line per service"""
+    width = max([len('service')] + [len(service_name) for service_name in results])
+    step_width = max([width + 9] + [len(name) for result in results.values() for name in result.steps])
+    lines = ['{}  {:>9}  {:>9}  {:>9}  {:>9}  {}'.format('service'.ljust(width), *STAGES, 'total', 'status')]
+    for result in results.values():
+        durations = ['{:>8.1f}s'.format(result.durations[stage]) if stage in result.durations else '{:>9}'.format('-')
+                     for stage in STAGES]
+        lines.append('{}  {}  {:>8.1f}s  {}'.format(result.service_name.ljust(width), '  '.join(durations),
+                                                    sum(result.durations.values()), result.description()))
+        for name, (status, duration) in result.steps.items():
+            lines.append('  {}  {:>8.1f}s  {}'.format(name.ljust(step_width), duration, status))
+    return '\n'.join(lines)
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+from os.path import join, isdir, normpath
+from collections import namedtuple, OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from devspace.exceptions import GitError
+from devspace.utils.database import open_database, database_file, mirror_name
+from devspace.utils.git import run_git
+from devspace.utils.misc import file_lock, lock_file
+from devspace.runners.mirror import now
+
+Mirror = namedtuple('Mirror', ['service_name', 'id', 'name', 'path', 'cost'])
+
+# the steps run on each mirror, in order
+STEPS = OrderedDict([
+    # pack the loose objects and merge the small packs, keeping a geometric
+    # progression of pack sizes, with a multi-pack-index and its bitmap
+    ('repack', ("repack", "-d", "--geometric=2", "--write-midx", "--write-bitmap-index")),
+    # add the new commits in a layer of the split commit-graph, with the
+    # changed paths bloom filters used by cgit log and file history
+    ('commit-graph', ("commit-graph", "write", "--reachable", "--split", "--changed-paths")),
+])
+
+
+class MaintenanceStats:
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.maintained = 0
+        self.deferred = 0
+        self.failed = 0
+        self.durations = OrderedDict((step, 0.0) for step in STEPS)
+
+    def summary(self):
+        return "{}: {} maintained, {} deferred, {} failed ({})".format(
+            self.service_name, self.maintained, self.deferred, self.failed,
+            ', '.join('{} {:.1f}s'.format(step, duration) for step, duration in self.durations.items()))
+
+
+class MaintenanceRunner:
+    """
+    Git maintenance of the mirrors of GitMirror services: incremental repack
+    with multi-pack-index and bitmaps, and split commit-graph with changed
+    paths, see STEPS.
+
+    Only the mirrors updated since their last maintenance are maintained, or
+    all of them with *force*. The time each one took is kept in the
+    Maintenance table. Maintenance gives way to synchronization: it holds the
+    service lock, runs MAINTAIN_JOBS mirrors at a time with the git commands
+    niced by MAINTAIN_NICE, and with a MAINTAIN_BUDGET in seconds, the mirrors
+    that would exceed it given their last cost are deferred to the next run.
+    """
+
+    def __init__(self, settings, jobs=None, budget=None, force=False):
+        self.settings = settings
+        self.jobs = jobs or int(settings.get('MAINTAIN_JOBS', 1))
+        self.budget = budget if budget is not None else float(settings.get('MAINTAIN_BUDGET', 0))
+        self.niceness = int(settings.get('MAINTAIN_NICE', 0))
+        self.timeout = int(settings.get('MIRROR_TIMEOUT', 0)) or None
+        self.force = force
+        self.stats = {}
+
+    def mirrors(self, service_name, conn):
+        data_dir = normpath(join(self.settings['SHARED_DATA'], service_name))
+        due = '' if self.force else "WHERE last_run IS NULL OR last_update > last_run "
+        mirrors = []
+        paths = set()
+        # the mirrors maintained the longest ago first
+        for repository_id, name, cost in conn.execute(
+                "SELECT id, name, duration FROM Repositories LEFT JOIN Maintenance ON repository_id = id " +
+                due + "ORDER BY last_run"):
+            name = mirror_name(name)
+            path = normpath(join(data_dir, name + '.git'))
+            # repositories of the same name share a mirror, it is maintained once
+            if path.startswith(data_dir + os.sep) and isdir(path) and path not in paths:
+                paths.add(path)
+                mirrors.append(Mirror(service_name, repository_id, name, path, cost or 0.0))
+        return mirrors
+
+    def maintain(self, mirror):
+        """Run the maintenance steps on *mirror*, return the duration of each one"""
+        durations = OrderedDict()
+        for step, args in STEPS.items():
+            start = time.monotonic()
+            run_git(*args, cwd=mirror.path, timeout=self.timeout, niceness=self.niceness)
+            durations[step] = time.monotonic() - start
+        return durations
+
+    def record(self, conn, mirror, future):
+        stats = self.stats[mirror.service_name]
+        try:
+            durations = future.result()
+        except (GitError, OSError) as e:
+            print("Error: {}: maintenance of {} failed: {}".format(mirror.service_name, mirror.name, e))
+            stats.failed += 1
+            return
+        stats.maintained += 1
+        for step, duration in durations.items():
+            stats.durations[step] += duration
+        conn.execute("INSERT OR REPLACE INTO Maintenance (repository_id, last_run, duration) VALUES (?, ?, ?)",
+                     (mirror.id, now(), sum(durations.values())))
+        conn.commit()
+
+    def run(self, service_names):
+        """Maintain the mirrors of *service_names*, return their MaintenanceStats"""
+        start = time.monotonic()
+        conns = {}
+        pending = []
+        locks = ExitStack()
+        for service_name in service_names:
+            if not locks.enter_context(file_lock(lock_file(self.settings, service_name), blocking=False)):
+                print("{}: being synchronized, maintenance skipped".format(service_name))
+                continue
+            self.stats[service_name] = MaintenanceStats(service_name)
+            conns[service_name] = open_database(database_file(self.settings, service_name))
+            pending.extend(self.mirrors(service_name, conns[service_name]))
+        pending.reverse()
+        running = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while running or pending:
+                    while pending and len(running) < self.jobs:
+                        mirror = pending.pop()
+                        elapsed = time.monotonic() - start
+                        if self.budget and elapsed + mirror.cost > self.budget:
+                            self.stats[mirror.service_name].deferred += 1
+                            continue
+                        running[executor.submit(self.maintain, mirror)] = mirror
+                    if not running:
+                        break
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.record(conns[running[future].service_name], running.pop(future), future)
+        finally:
+            for conn in conns.values():
+                conn.close()
+            locks.close()
+        return self.stats
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import hashlib
+from os.path import join, isdir, normpath
+from shutil import rmtree
+from collections import namedtuple, deque, Counter
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+from devspace.exceptions import GitError
+from devspace.utils.database import open_database, database_file, mirror_name, shared_mirror_names
+from devspace.utils.git import run_git, write_agefile, iter_git_dirs
+from devspace.utils.misc import file_lock, lock_file
+from devspace.utils.repolist import repo_list_writer
+
+Repository = namedtuple('Repository', ['service_name', 'id', 'name', 'clone_url', 'path', 'tips', 'interval'])
+
+# results stored in the database at once
+COMMIT_EVERY = 100
+
+
+def now(delay=0):
+    # the format of sqlite datetime('now'), in UTC
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() + delay))
+
+
+def upstream_host(clone_url):
+    if '://' not in clone_url and ':' in clone_url:
+        # scp-like syntax: user@host:path
+        return clone_url.split(':', 1)[0].rsplit('@', 1)[-1]
+    parts = urlsplit(clone_url)
+    return parts.hostname or parts.scheme or 'local'
+
+
+class MirrorStats:
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.fetched = 0
+        self.skipped = 0
+        self.updated = 0
+        self.failed = 0
+        self.not_due = 0
+
+    def summary(self):
+        summary = "{}: {} fetched, {} skipped, {} updated, {} failed".format(self.service_name, self.fetched,
+                                                                             self.skipped, self.updated, self.failed)
+        if self.not_due:
+            summary += ", {} not due".format(self.not_due)
+        return summary
+
+
+class MirrorRunner:
+    """
+    Mirrors the repositories listed in the Repositories table of GitMirror
+    services into SHARED_DATA/<service_name>/<name>.git.
+
+    Repositories are cloned or fetched on a pool of MIRROR_JOBS workers, with at
+    most MIRROR_HOST_JOBS of them on the same upstream host. A failed fetch is
+    retried MIRROR_RETRIES times, waiting MIRROR_RETRY_BACKOFF seconds doubled at
+    each retry. Only the main thread writes last_check and last_update.
+
+    Before fetching, the refs advertised by the upstream (git ls-remote) are
+    compared with the ones seen at the last fetch, kept in the RefTips table:
+    a repository whose refs didn't change is skipped, unless *force* is set.
+
+    A service is synchronized by one process at a time, holding its lock in
+    LOCKS_DIR. With *adaptive*, each repository is only checked when due: its
+    interval is halved when it changed and doubled when it didn't, between
+    MIRROR_MIN_INTERVAL and MIRROR_MAX_INTERVAL.
+
+    Once done, the cgit repository list of the services is written again when
+    their repositories changed, see RepoListWriter.
+    """
+
+    def __init__(self, settings, jobs=None, host_jobs=None, retries=None, force=False, adaptive=None):
+        self.settings = settings
+        self.force = force
+        self.adaptive = adaptive if adaptive is not None else settings.get_bool('MIRROR_ADAPTIVE')
+        self.min_interval = int(settings.get('MIRROR_MIN_INTERVAL', 300))
+        self.max_interval = int(settings.get('MIRROR_MAX_INTERVAL', 86400))
+        self.jobs = jobs or int(settings.get('MIRROR_JOBS', 8))
+        self.host_jobs = host_jobs or int(settings.get('MIRROR_HOST_JOBS', 4))
+        self.retries = retries if retries is not None else int(settings.get('MIRROR_RETRIES', 2))
+        self.backoff = float(settings.get('MIRROR_RETRY_BACKOFF', 2))
+        self.timeout = int(settings.get('MIRROR_TIMEOUT', 0)) or None
+        self.stats = {}
+
+    def repositories(self, service_name, conn):
+        data_dir = normpath(join(self.settings['SHARED_DATA'], service_name))
+        due = ''
+        if self.adaptive:
+            due = "WHERE next_check IS NULL OR next_check <= :now "
+            self.stats[service_name].not_due = conn.execute("SELECT COUNT(*) FROM Repositories "
+                                                            "WHERE next_check > ?", (now(),)).fetchone()[0]
+        repositories = []
+        shared = shared_mirror_names(conn)
+        for name in sorted(shared):
+            print("Error: {}: several repositories named {}, none of them is mirrored".format(service_name, name))
+        # the repositories checked the longest ago first
+        for repository_id, name, clone_url, tips, interval in conn.execute(
+                "SELECT id, name, clone_url, tips, check_interval FROM Repositories "
+                "LEFT JOIN RefTips ON repository_id = id " + due + "ORDER BY last_check", {'now': now()}):
+            name = mirror_name(name)
+            path = normpath(join(data_dir, name + '.git'))
+            if not path.startswith(data_dir + os.sep):
+                print("Error: {}: invalid repository name {}".format(service_name, name))
+                self.stats[service_name].failed += 1
+                continue
+            if name in shared:
+                # they would clone and fetch into the same directory
+                self.stats[service_name].failed += 1
+                continue
+            repositories.append(Repository(service_name, repository_id, name, clone_url, path, tips, interval))
+        return repositories
+
+    def fetch(self, repository):
+        """Clone or fetch the mirror of *repository*, return whether its refs changed.
+        The cgit agefile of the mirror is written when they did.
+        """
+        if not isdir(repository.path):
+            tmp_path = repository.path + '.tmp'
+            if os.path.exists(tmp_path):
+                rmtree(tmp_path)
+            os.makedirs(os.path.dirname(tmp_path), exist_ok=True)
+            run_git("clone", "--mirror", "--quiet", repository.clone_url, tmp_path, timeout=self.timeout)
+            write_agefile(tmp_path)
+            os.replace(tmp_path, repository.path)
+            return True
+        before = run_git("for-each-ref", "--format=%(objectname) %(refname)", cwd=repository.path)
+        run_git("fetch", "--prune", "--quiet", "origin", cwd=repository.path, timeout=self.timeout)
+        after = run_git("for-each-ref", "--format=%(objectname) %(refname)", cwd=repository.path)
+        if before == after:
+            return False
+        write_agefile(repository.path)
+        return True
+
+    def ref_tips(self, repository):
+        refs = run_git("ls-remote", repository.clone_url, timeout=self.timeout)
+        return hashlib.sha1(''.join(sorted(refs.splitlines(True))).encode('utf8')).hexdigest()
+
+    def sync(self, repository):
+        """Return (fetched, updated, tips) for *repository*, retrying on failure"""
+        for attempt in range(self.retries + 1):
+            try:
+                tips = self.ref_tips(repository)
+                if not self.force and tips == repository.tips and isdir(repository.path):
+                    return False, False, tips
+                return True, self.fetch(repository), tips
+            except GitError:
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def record(self, conn, repository, future):
+        stats = self.stats[repository.service_name]
+        try:
+            fetched, updated, tips = future.result()
+        except (GitError, OSError) as e:
+            # last_check is kept, the repository comes first on the next run
+            print("Error: {}: mirror {} failed: {}".format(repository.service_name, repository.clone_url, e))
+            stats.failed += 1
+            return
+        columns = {'last_check': now()}
+        if not fetched:
+            stats.skipped += 1
+        else:
+            stats.fetched += 1
+            conn.execute("INSERT INTO RefTips (repository_id, tips) VALUES (?, ?) "
+                         "ON CONFLICT (repository_id) DO UPDATE SET tips = excluded.tips", (repository.id, tips))
+        if updated:
+            stats.updated += 1
+            columns['last_update'] = columns['last_check']
+        if self.adaptive:
+            interval = repository.interval or self.min_interval
+            interval = max(self.min_interval, interval // 2) if updated else min(self.max_interval, interval * 2)
+            columns.update(check_interval=interval, next_check=now(interval))
+        conn.execute("UPDATE Repositories SET {} WHERE id = ?".format(', '.join(c + ' = ?' for c in columns)),
+                     list(columns.values()) + [repository.id])
+
+    def run(self, service_names):
+        """Mirror the repositories of *service_names*, return their MirrorStats"""
+        conns = {}
+        pending = {}
+        locks = ExitStack()
+        for service_name in service_names:
+            if not locks.enter_context(file_lock(lock_file(self.settings, service_name), blocking=False)):
+                print("{}: already being synchronized, skipped".format(service_name))
+                continue
+            self.stats[service_name] = MirrorStats(service_name)
+            conns[service_name] = open_database(database_file(self.settings, service_name))
+            for repository in self.repositories(service_name, conns[service_name]):
+                pending.setdefault(upstream_host(repository.clone_url), deque()).append(repository)
+        active = Counter()
+        running = {}
+        recorded = 0
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                while running or any(pending.values()):
+                    # fill the free workers, without exceeding the limit of each host
+                    for host, queue in pending.items():
+                        while queue and active[host] < self.host_jobs and len(running) < self.jobs:
+                            repository = queue.popleft()
+                            active[host] += 1
+                            running[executor.submit(self.sync, repository)] = host, repository
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        host, repository = running.pop(future)
+                        active[host] -= 1
+                        self.record(conns[repository.service_name], repository, future)
+                        recorded += 1
+                        if recorded % COMMIT_EVERY == 0:
+                            for conn in conns.values():
+                                conn.commit()
+            # list the repositories mirrored for the first time in cgit
+            for service_name, conn in conns.items():
+                conn.commit()
+                repo_list_writer(self.settings, service_name, conn).write()
+        finally:
+            for conn in conns.values():
+                conn.commit()
+                conn.close()
+            locks.close()
+        return self.stats
+
+
+class AgefileStats:
+
+    def __init__(self, service_name):
+        self.service_name = service_name
+        self.written = 0
+        self.unchanged = 0
+        self.failed = 0
+
+    def summary(self):
+        return "{}: {} agefiles written, {} up to date, {} failed".format(self.service_name, self.written,
+                                                                          self.unchanged, self.failed)
+
+
+def write_agefiles(settings, service_names, jobs=None):
+    """Write the cgit agefile of all the repositories in the data directory of *service_names*,
+    for the ones mirrored before agefiles were written. Return their AgefileStats.
+    """
+    stats = {}
+    with ThreadPoolExecutor(max_workers=jobs or int(settings.get('MIRROR_JOBS', 8))) as executor:
+        for service_name in service_names:
+            stats[service_name] = AgefileStats(service_name)
+            git_dirs = list(iter_git_dirs(join(settings['SHARED_DATA'], service_name)))
+            futures = {executor.submit(write_agefile, git_dir): git_dir for git_dir in git_dirs}
+            for future in futures:
+                try:
+                    if future.result():
+                        stats[service_name].written += 1
+                    else:
+                        stats[service_name].unchanged += 1
+                except (GitError, OSError) as e:
+                    print("Error: {}: agefile of {} failed: {}".format(service_name, futures[future], e))
+                    stats[service_name].failed += 1
+    return stats
@@ -2,12 +2,15 @@
 # -*- coding: utf-8 -*-
 
 import os
-import subprocess
+from functools import partial
 import yaml
-import string
-from os.path import join, exists
+from os.path import join, exists, isfile
+import devspace
 from devspace.exceptions import ConfigurationError
-from devspace.utils.misc import render_template, copytree
+from devspace.utils.misc import substitute_template, copytree, fast_copy, stagger_crontabs
+from devspace.utils.manifest import RenderManifest, hash_inputs
+from devspace.utils.git import clone_app, update_app
+from devspace.utils.template import compile_template
 
 
 class PrettyDumper(yaml.SafeDumper):
@@ -25,8 +28,10 @@ class DevSpaceServer:
     type = ''
     image_support = ['debian', 'alpine']
 
-    def __init__(self, project_settings=None):
+    def __init__(self, project_settings=None, targets=None):
         self.server_name = self.__class__.__name__
+        # names of the services to render, None for all of them
+        self.targets = set(targets) if targets is not None else None
         self.image = ''
         self.services = {}
         self.localization = False
@@ -34,7 +39,9 @@ class DevSpaceServer:
             raise ValueError("project setting is need for init server")
         self.settings = project_settings
         self.templates_mapping = {}
+        self.manifest = None
         self.load_settings()
+        self.crontabs = self.schedule()
 
     def load_settings(self):
         server_settings = self.settings['servers']
@@ -47,10 +54,9 @@ class DevSpaceServer:
         if 'localization' in server_settings[self.server_name]:
             self.localization = server_settings[self.server_name]['localization']
 
-    def dockerfile(self, tz=True, distros=True, python=True):
+    def dockerfile_variables(self, tz=True, distros=True, python=True):
         # ${image} ${maintainer}, ${localization_distros_mirror}, ${localization_tz}, ${localization_python_mirror}
-        template_file = self.templates_mapping['Dockerfile'][0]
-        dst_file = self.templates_mapping['Dockerfile'][1]
+        # subclasses add their own variables, the Dockerfile is rendered in one pass
         image = self.settings.get("IMAGE_{}".format(self.image.upper()), "")
         if not image:
             raise ValueError("Can't get image base from setting")
@@ -91,10 +97,14 @@ class DevSpaceServer:
             localization_python_mirror += "    && pip3 config set global.index-url {} \\\n".format(local_python_mirror)
             localization_python_mirror += "    # install python packages"
 
-        template_file = string.Template(template_file).safe_substitute(image=self.image)
-        render_template(template_file, dst_file, image=image, maintainer=maintainer,
-                        localization_distros_mirror=localization_distros_mirror, localization_tz=localization_tz,
-                        localization_python_mirror=localization_python_mirror)
+        return dict(image=image, maintainer=maintainer, localization_distros_mirror=localization_distros_mirror,
+                    localization_tz=localization_tz, localization_python_mirror=localization_python_mirror)
+
+    def dockerfile(self, tz=True, distros=True, python=True):
+        template_file = self.templates_mapping['Dockerfile'][0]
+        dst_file = self.templates_mapping['Dockerfile'][1]
+        template_file = compile_template(template_file).safe_substitute(image=self.image)
+        self.render_template(template_file, dst_file, **self.dockerfile_variables(tz, distros, python))
 
     def create_server_base_structure(self, ignore):
         template_srv_dir = join(self.settings.get("TEMPLATES_DIR", ""), self.__class__.__name__) if \
@@ -104,26 +114,29 @@ class DevSpaceServer:
         if not template_srv_dir or not prj_srv_dir:
             raise ValueError("Can't get Template or Project directory from setting")
         os.makedirs(prj_srv_dir, exist_ok=True)
-        copytree(template_srv_dir, prj_srv_dir, ignore)
+        copytree(template_srv_dir, prj_srv_dir, ignore, copy_function=self.copy_file)
 
     def install_app(self, src):
+        """
+        Clone the app from *src*, through the clone cache shared by the projects
+        of the host (APPS_CACHE). An installed app is only updated with UPDATE_APPS.
+        """
         prj_srv_dir = join(self.settings['project']['path'], "servers", self.server_name)
         # generate apps
         apps_dir = join(prj_srv_dir, 'apps')
         os.makedirs(apps_dir, exist_ok=True)
+        cache_dir = self.settings.get('APPS_CACHE', '')
         if not exists(join(apps_dir, '.git')):
-            ret = subprocess.run(["git", "clone", src, apps_dir], stdout=subprocess.DEVNULL)
-            if ret.returncode != 0:
-                raise RuntimeError("Clone app failed, please try render again")
-        else:
-            pass
+            clone_app(src, apps_dir, cache_dir)
+        elif self.settings.get_bool('UPDATE_APPS'):
+            update_app(src, apps_dir, cache_dir)
 
     def start_script(self):
         src_file = self.templates_mapping['StartScript'][0]
         dst_file = self.templates_mapping['StartScript'][1]
 
-        dst_file_linux = string.Template(dst_file).safe_substitute(ext='sh')
-        dst_file_win = string.Template(dst_file).safe_substitute(ext='bat')
+        dst_file_linux = compile_template(dst_file).safe_substitute(ext='sh')
+        dst_file_win = compile_template(dst_file).safe_substitute(ext='bat')
         volume = ''
         volume += '\n' + ' ' * 11 + '-v {}:/apps \\'.format(join(self.settings['project']['path'], 'servers',
                                                                  self.server_name, 'apps').replace("\\", "/"))
@@ -135,15 +148,106 @@ class DevSpaceServer:
         shell = '/bin/bash'
         if self.image == 'alpine':
             shell = '/bin/sh'
-        render_template(src_file, dst_file_linux, volume=volume, shebang='#!/bin/sh', shell=shell,
-                        container_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
-        render_template(src_file, dst_file_win, volume=volume, shebang='', shell=shell,
-                        container_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
+        self.render_template(src_file, dst_file_linux, volume=volume, shebang='#!/bin/sh', shell=shell,
+                             container_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
+        self.render_template(src_file, dst_file_win, volume=volume, shebang='', shell=shell,
+                             container_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
 
     def start_script_service_volume(self):
         raise NotImplementedError
 
-    def render(self):
+    def is_target(self, service_name):
+        """Whether the per-service outputs of *service_name* are rendered"""
+        return self.targets is None or service_name in self.targets
+
+    def render_template(self, template_path, dst_path, service=None, **kwargs):
+        # *service* owns the output, None when it is shared by all services
+        inputs = hash_inputs(template_path, **kwargs)
+        if self.manifest.is_fresh(dst_path, inputs):
+            self.manifest.keep(dst_path, service)
+            return False
+        content = substitute_template(template_path, **kwargs)
+        return self.manifest.write(dst_path, content, inputs, service)
+
+    def write_file(self, dst_path, content, service=None, **inputs):
+        return self.manifest.write(dst_path, content, hash_inputs(**inputs), service)
+
+    def copy_file(self, src, dst, service=None):
+        return self.manifest.copy(src, dst, service, fast_copy)
+
+    def copy_asset(self, src, dst, service=None):
+        # read-only assets may be hard linked or cloned instead of copied, see COPY_MODE
+        return self.manifest.copy(src, dst, service, partial(fast_copy, mode=self.settings.get('COPY_MODE', 'copy')))
+
+    def server_digest(self):
+        """Digest of what all the outputs depend on: the server settings and the templates"""
+        templates = sorted({template for template, _ in self.templates_mapping.values() if isfile(template)})
+        return hash_inputs(*templates, version=devspace.__version__, servers=self.settings['servers'],
+                           project=self.settings['project'], maintainer=self.settings.get('maintainer', ''))
+
+    def schedule(self):
+        """
+        The synchronization crontab of each service of the server. With STAGGER_CRONTABS,
+        each one is shifted by an offset of its own, see stagger_crontabs, so the services
+        of a project don't all start their synchronization at the same minute.
+        """
+        crontabs = {}
+        for service_name, service_settings in (self.settings['services'] or {}).items():
+            for server_name, server_settings in service_settings.items():
+                if isinstance(server_settings, dict) and server_settings.get('synchronization', {}).get('crontab'):
+                    crontabs[(server_name, service_name)] = server_settings['synchronization']['crontab']
+        if self.settings.get_bool('STAGGER_CRONTABS'):
+            crontabs = stagger_crontabs(crontabs)
+        return {service_name: crontab for (server_name, service_name), crontab in crontabs.items()
+                if server_name == self.server_name}
+
+    def service_digest(self, service_name, service):
+        """Digest of what the outputs of *service_name* depend on"""
+        return hash_inputs(service=service, crontab=self.crontabs.get(service_name, ''))
+
+    def render(self, changed=False):
+        """
+        Render the server into the project, only files whose content changed are written
+        and files produced by a previous render but not by this one are removed.
+
+        With *changed*, only the outputs of the services whose settings changed since
+        the last render are rendered, those recorded with their service in the manifest.
+        The outputs shared by all services (Dockerfile, nginx default, index.html,
+        assets.json...) are always rendered again, and only written when their content
+        changed. Everything is rendered when the server settings or templates changed.
+        """
+        self.manifest = RenderManifest(self.settings['RENDER_MANIFEST'], self.server_name,
+                                       self.settings['project']['path'])
+        server_digest = self.server_digest()
+        service_digests = {service_name: self.service_digest(service_name, service)
+                           for service_name, service in self.services.items()}
+        if changed:
+            changed_services = self.manifest.changed_services(server_digest, service_digests)
+            if changed_services is not None:
+                if self.targets is not None:
+                    changed_services &= self.targets
+                if not changed_services and not self.settings.get_bool('UPDATE_APPS'):
+                    print("{}: up to date".format(self.server_name))
+                    return
+                if changed_services:
+                    print("{}: changed services: {}".format(self.server_name, ', '.join(sorted(changed_services))))
+                self.targets = changed_services
+        self.manifest.start(self.targets)
+        self.render_server()
+        self.manifest.prune()
+        if self.targets is None:
+            self.manifest.server = server_digest
+            self.manifest.services = service_digests
+        else:
+            for service_name in self.targets:
+                if service_name in service_digests:
+                    self.manifest.services[service_name] = service_digests[service_name]
+                else:
+                    self.manifest.services.pop(service_name, None)
+        self.manifest.save()
+        print(self.manifest.summary())
+
+    def render_server(self):
         raise NotImplementedError
 
     def generate_docker_compose_service(self):
@@ -153,13 +257,17 @@ class DevSpaceServer:
         project_dir = self.settings.get('project_dir','')
         docker_compose_file = os.path.join(project_dir, 'docker-compose.yaml')
         with open(docker_compose_file, ) as f:
-            docker_compose_content = yaml.safe_load(f)
+            raw = f.read()
+        docker_compose_content = yaml.safe_load(raw)
         if 'services' not in docker_compose_content:
             raise ValueError('{} format wrong'.format(docker_compose_file))
         service_content = yaml.safe_load(self.generate_docker_compose_service())
         if not docker_compose_content['services']:
             docker_compose_content['services'] = {}
         docker_compose_content['services'][self.server_name.lower()] = service_content[self.server_name.lower()]
+        document = yaml.dump(docker_compose_content, Dumper=PrettyDumper,
+                             default_flow_style=False, sort_keys=False)
+        if document == raw:
+            return
         with open(docker_compose_file, 'w') as f:
-            document = yaml.dump(docker_compose_content, f, Dumper=PrettyDumper,
-                                 default_flow_style=False, sort_keys=False)
+            f.write(document)
@@ -7,8 +7,10 @@ import yaml
 from os.path import join
 import json
 from shutil import ignore_patterns
-from devspace.utils.misc import render_template
+from devspace.utils.template import get_template
 from devspace.servers import DevSpaceServer
+from devspace.exceptions import BuildError, ConfigurationError
+from devspace.runners.docs import is_step_list, build_steps, sequential_build
 
 
 TEMPLATES_MAPPING = {
@@ -30,10 +32,10 @@ class DocBuilder(DevSpaceServer):
     image_support = ['debian', 'alpine']
     support_builder_type = ['docbook', 'sphinx']
 
-    def __init__(self, server_settings=None):
+    def __init__(self, server_settings=None, targets=None):
         self.cron = False
         self.builder = []
-        super().__init__(server_settings)
+        super().__init__(server_settings, targets)
         self.templates_mapping = json.loads(string.Template(json.dumps(TEMPLATES_MAPPING)).safe_substitute(
             TEMPLATES_DIR=self.settings.get("TEMPLATES_DIR", "").replace("\\", "/"),
             image=self.image,
@@ -55,11 +57,9 @@ class DocBuilder(DevSpaceServer):
                     if 'synchronization' in service_setting[self.__class__.__name__].keys():
                         self.cron = True
 
-    def dockerfile(self, tz=True, distros=True, python=True):
+    def dockerfile_variables(self, tz=True, distros=True, python=True):
         # ${docbook_builder} ${sphnix_builder}
-        super().dockerfile(tz, distros, python)
-        dst_file = self.templates_mapping['Dockerfile'][1]
-
+        variables = super().dockerfile_variables(tz, distros, python)
         docbook_builder = ""
         sphnix_builder = ""
 
@@ -70,8 +70,8 @@ class DocBuilder(DevSpaceServer):
                 docbook_builder = "xsltproc \\"
         if "sphinx" in self.builder:
             sphnix_builder = "&& pip3 install --no-cache-dir sphinx sphinx_rtd_theme recommonmark \\"
-        render_template(dst_file, dst_file, docbook_builder=docbook_builder,
-                        sphnix_builder=sphnix_builder)
+        variables.update(docbook_builder=docbook_builder, sphnix_builder=sphnix_builder)
+        return variables
 
     def start_script_service_volume(self):
         volume = ''
@@ -90,8 +90,20 @@ class DocBuilder(DevSpaceServer):
         prj_srv_dir = join(self.settings['project']['path'], "servers", self.server_name)
         # generate database
         database = join(prj_srv_dir, 'apps', 'database.json')
-        with open(database, 'w', encoding="utf-8") as f:
-            json.dump(self.services, f, indent=2, ensure_ascii=False)
+        services = {}
+        for service_name, service in self.services.items():
+            services[service_name] = dict(service)
+            if is_step_list(service.get('build', [])):
+                # the container runs the steps one after the other, devspace run docs runs them concurrently
+                services[service_name]['steps'] = service['build']
+                try:
+                    services[service_name]['build'] = sequential_build(build_steps(service['build']))
+                except BuildError as e:
+                    raise ConfigurationError("{}: {}".format(service_name, e))
+            if service_name in self.crontabs:
+                services[service_name]['synchronization'] = dict(service['synchronization'],
+                                                                 crontab=self.crontabs[service_name])
+        self.write_file(database, json.dumps(services, indent=2, ensure_ascii=False), services=services)
         # make www
         www_dir = self.settings.get("SHARED_WEB", "")
         os.makedirs(www_dir, exist_ok=True)
@@ -106,7 +118,7 @@ class DocBuilder(DevSpaceServer):
         log_dir = join(self.settings.get("SHARED_LOG", ""), self.server_name)
         os.makedirs(log_dir, exist_ok=True)
 
-    def render(self):
+    def render_server(self):
         self.create_server_structure()
         self.dockerfile()
         if not self.cron:
@@ -114,10 +126,8 @@ class DocBuilder(DevSpaceServer):
 
     def generate_docker_compose_service(self):
         template_file = self.templates_mapping['DockerCompose'][0]
-        with open(template_file, 'rb') as fp:
-            raw = fp.read().decode('utf8')
-            content = string.Template(raw).safe_substitute(
-                server_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
+        content = get_template(template_file).safe_substitute(
+            server_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
         service_content = yaml.safe_load(content)
         for service_name, service in self.services.items():
             service_content['docbuilder']['volumes'].append('./data/{}:/docs/{}'.format(service_name, service_name))
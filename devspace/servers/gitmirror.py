@@ -7,7 +7,10 @@ import yaml
 from os.path import join
 import json
 from shutil import ignore_patterns
-from devspace.utils.misc import render_template
+from devspace.utils.template import compile_template, get_template
+from devspace.utils.database import open_database, update_service
+from devspace.utils.misc import file_lock, lock_file
+from devspace.utils.repolist import repo_list_writer
 from devspace.servers import DevSpaceServer
 
 
@@ -15,9 +18,9 @@ TEMPLATES_MAPPING = {
     # ${maintainer}, ${localization}, ${image}, ${port}
     "Dockerfile": ("${TEMPLATES_DIR}/GitMirror/Dockerfile-${image}${cron}.template",
                    "${project_dir}/servers/GitMirror/Dockerfile"),
-    # ${nginx_service} ${port}
-    "Sqlite": ("${TEMPLATES_DIR}/GitMirror/apps/database/repository.sql.template",
-               "${project_dir}/servers/GitMirror/apps/database/${service_name}.sql"),
+    # built with sqlite3, not from a template
+    "Database": ("",
+                 "${project_dir}/servers/GitMirror/apps/database/${service_name}.db"),
     # ${server_name}
     'DockerCompose': ('${TEMPLATES_DIR}/GitMirror/server.yaml.template', ''),
     # ${volume} ${container_name} ${shell}
@@ -34,9 +37,9 @@ class GitMirror(DevSpaceServer):
     image_support = ['debian', 'alpine']
     support_repository_type = ['cgit', 'github', 'gitee']
 
-    def __init__(self, server_settings=None):
+    def __init__(self, server_settings=None, targets=None):
         self.cron = False
-        super().__init__(server_settings)
+        super().__init__(server_settings, targets)
         self.templates_mapping = json.loads(string.Template(json.dumps(TEMPLATES_MAPPING)).safe_substitute(
             TEMPLATES_DIR=self.settings.get("TEMPLATES_DIR", "").replace("\\", "/"),
             image=self.image,
@@ -53,8 +56,11 @@ class GitMirror(DevSpaceServer):
                     if 'synchronization' in service_setting[self.__class__.__name__].keys():
                         self.cron = True
 
-    def sqlite(self):
-        # ${title}, ${description}, ${max-repo-count},${service_name}
+    def database(self):
+        """
+        Create or update the database of each service, the state kept by the
+        mirror survives, and the cgit repository list of its mirrors
+        """
         server_settings = self.settings['servers']
         host = "localhost"
         port = "8080"
@@ -63,21 +69,36 @@ class GitMirror(DevSpaceServer):
         if 'Web' in server_settings and 'port' in server_settings['Web']:
             port = server_settings['Web']['port']
         host = '{}:{}'.format(host, port)
+        dst_template = compile_template(self.templates_mapping['Database'][1])
         for service_name, service in self.services.items():
+            if not self.is_target(service_name):
+                continue
             consistency = 0
             crontab = ""
             if 'synchronization' in service.keys():
                 if 'consistency' in service['synchronization']:
                     consistency = 1 if service['synchronization']['consistency'] else 0
-                if 'crontab' in service['synchronization']:
-                    crontab = service['synchronization']['crontab']
-                del service['synchronization']
-            repositories = json.dumps(service)
-            template_file = self.templates_mapping['Sqlite'][0]
-            dst_file = self.templates_mapping['Sqlite'][1]
-            dst_file = string.Template(dst_file).safe_substitute(service_name=service_name)
-            render_template(template_file, dst_file, consistency=consistency, crontab=crontab,
-                            repositories=repositories, service_name=service_name, host=host)
+                crontab = self.crontabs.get(service_name, '')
+            repositories = {source_type: sources for source_type, sources in service.items()
+                            if source_type in self.support_repository_type}
+            dst_file = dst_template.safe_substitute(service_name=service_name)
+            os.makedirs(os.path.dirname(dst_file), exist_ok=True)
+            # the script rendered before the database was built here, replayed by gitmirror.py --init
+            legacy_sql = os.path.splitext(dst_file)[0] + '.sql'
+            if os.path.isfile(legacy_sql):
+                os.remove(legacy_sql)
+            conn = open_database(dst_file)
+            try:
+                update_service(conn, service_name, host, consistency, crontab, repositories)
+                # the mirror writes the same files while it runs, and again once done
+                with file_lock(lock_file(self.settings, service_name), blocking=False) as locked:
+                    if locked:
+                        repo_list_writer(self.settings, service_name, conn).write()
+                    else:
+                        print("{}: being synchronized, the repository list is left to the mirror".format(
+                            service_name))
+            finally:
+                conn.close()
 
     def start_script_service_volume(self):
         volume = ''
@@ -98,19 +119,17 @@ class GitMirror(DevSpaceServer):
         log_dir = join(self.settings.get("SHARED_LOG", ""), self.server_name)
         os.makedirs(log_dir, exist_ok=True)
 
-    def render(self):
+    def render_server(self):
         self.create_server_structure()
         self.dockerfile()
-        self.sqlite()
+        self.database()
         if not self.cron:
             self.start_script()
 
     def generate_docker_compose_service(self):
         template_file = self.templates_mapping['DockerCompose'][0]
-        with open(template_file, 'rb') as fp:
-            raw = fp.read().decode('utf8')
-            content = string.Template(raw).safe_substitute(
-                server_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
+        content = get_template(template_file).safe_substitute(
+            server_name=(self.settings['project']['name'] + '_' + self.server_name).lower())
         service_content = yaml.safe_load(content)
         for service_name, service in self.services.items():
             service_content['gitmirror']['volumes'].append('./data/{}:/srv/git/{}'.format(service_name, service_name))
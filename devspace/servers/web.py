@@ -5,8 +5,12 @@ import string
 import os
 from os.path import join, normpath, isfile, exists
 import json
-from shutil import ignore_patterns, copy2
-from devspace.utils.misc import render_template, copytree
+from collections import OrderedDict
+from shutil import ignore_patterns
+from devspace.utils.misc import copytree
+from devspace.utils.template import compile_template, get_template
+from devspace.utils.manifest import hash_inputs, hash_file
+from devspace.utils.precompress import precompress
 from devspace.servers import DevSpaceServer
 import yaml
 
@@ -15,16 +19,20 @@ TEMPLATES_MAPPING = {
     # ${maintainer}, ${localization}, ${image}, ${port}
     "Dockerfile": ("${TEMPLATES_DIR}/Web/Dockerfile-${image}.template",
                    "${project_dir}/servers/Web/Dockerfile"),
-    # ${title}, ${description}, ${max-repo-count},${service_name}, ${host}
+    # ${title}, ${description}, ${max-repo-count},${service_name}, ${host}, ${enable_http_clone},
+    # ${cache_size}, ${cache_*_ttl}, ${css}, ${logo}, ${favicon}, ${clone_url}
     "Cgit_Config": ('${TEMPLATES_DIR}/Web/config/cgit/cgitrc.template',
                     '${project_dir}/servers/Web/config/cgit/${service_name}.cgit.com'),
-    # ${nginx_service} ${port}
+    # ${nginx_service} ${port} ${fastcgi_cache_path}
     "Nginx_Default": ('${TEMPLATES_DIR}/Web/config/nginx/default.template',
                       '${project_dir}/servers/Web/config/nginx/default'),
-    # ${service_name}
+    # ${service_name} ${port} ${git_http} ${fastcgi_cache}, only in the proxy cgit mode
     "Nginx_Config": ('${TEMPLATES_DIR}/Web/config/nginx/cgit.template',
                      '${project_dir}/servers/Web/config/nginx/${service_name}.cgit.com'),
-    # ${services}
+    # ${jquery}, ${magic}, ${assets}
+    "Head_Option": ('${TEMPLATES_DIR}/Web/config/cgit/head_option.template',
+                    '${project_dir}/servers/Web/config/cgit/head_option'),
+    # ${services}, ${favicon}
     'Index': ('${TEMPLATES_DIR}/Web/www/index.html.template',
               '${project_dir}/www/index.html'),
     # ${server_name}
@@ -32,6 +40,34 @@ TEMPLATES_MAPPING = {
 }
 
 
+# the cgit cache ttls in minutes, cgit defaults unless set in cgit_options
+CGIT_CACHE_TTLS = OrderedDict([
+    ('cache-root-ttl', 5),
+    ('cache-repo-ttl', 5),
+    ('cache-static-ttl', -1),
+    ('cache-dynamic-ttl', 5),
+    ('cache-about-ttl', 15),
+    ('cache-snapshot-ttl', 5),
+])
+
+# the tmpfs holding the cgit caches, and the nginx one under _nginx, unless set in cgit_cache
+CGIT_CACHE_TMPFS = '256m'
+
+FASTCGI_CACHE_DEFAULTS = {'max_size': '128m', 'inactive': '10m', 'valid': '1m'}
+
+# the static cgit files served under their name only, crawlers look for it
+UNHASHED_ASSETS = ('robots.txt',)
+
+# the content-hashed copies of the static cgit files, name.<hash>.ext, never change
+HASHED_ASSET_LOCATION = '~ "^/cgit/.+\\.[0-9a-f]{8}\\.\\w+$"'
+IMMUTABLE_CACHE = 'add_header Cache-Control "public, max-age=31536000, immutable";'
+
+
+def _hashed_name(path, digest):
+    root, ext = os.path.splitext(path)
+    return '{}.{}{}'.format(root, digest[:8], ext)
+
+
 def _is_valid_cgit_options(cgit_options):
     if 'logo' in cgit_options:
         if not isfile(cgit_options['logo']['light']):
@@ -47,11 +83,14 @@ class Web(DevSpaceServer):
     type = 'Web'
     image_support = ['debian', 'alpine']
 
-    def __init__(self, server_settings=None):
+    def __init__(self, server_settings=None, targets=None):
         self.host = ""
         self.port = -1
         self.cgit = False
-        super().__init__(server_settings)
+        self.cgit_mode = 'proxy'
+        # the url of each static cgit file, to the url of its content-hashed copy
+        self.assets = {}
+        super().__init__(server_settings, targets)
         self.templates_mapping = json.loads(string.Template(json.dumps(TEMPLATES_MAPPING)).safe_substitute(
             TEMPLATES_DIR=self.settings.get("TEMPLATES_DIR", "").replace("\\", "/"),
             image=self.image,
@@ -63,6 +102,13 @@ class Web(DevSpaceServer):
         server_settings = self.settings['servers']
         self.host = server_settings[self.server_name]['host']
         self.port = server_settings[self.server_name]['port']
+        # proxy: each cgit service has its own virtual host, reached through an internal proxy_pass
+        # fastcgi: the locations of the default server pass the cgit services to fcgiwrap directly
+        self.cgit_mode = server_settings[self.server_name].get('cgit_mode', 'proxy')
+        # clones through git-http-backend (smart HTTP) rather than cgit (dumb HTTP)
+        self.smart_http = server_settings[self.server_name].get('smart_http', False)
+        # tmpfs of the cgit caches, and the optional nginx cache of the cgit pages in front of fcgiwrap
+        self.cgit_cache = server_settings[self.server_name].get('cgit_cache', {})
         if self.settings['services']:
             for service_name, service_setting in self.settings['services'].items():
                 if self.__class__.__name__ in service_setting:
@@ -72,38 +118,174 @@ class Web(DevSpaceServer):
                         if not _is_valid_cgit_options(service_setting[self.__class__.__name__]['cgit_options']):
                             raise ValueError("Wrong cgit_options, service_name: {}".format(service_name))
 
-    def dockerfile(self, tz=True, distros=True, python=True):
+    def service_digest(self, service_name, service):
+        # the logos are copied from outside the project
+        logos = service.get('cgit_options', {}).get('logo', {})
+        return hash_inputs(*[logos[theme] for theme in sorted(logos)], service=service)
+
+    def dockerfile_variables(self, tz=True, distros=True, python=True):
         # ${port}
-        super().dockerfile(tz, distros, python)
-        dst_file = self.templates_mapping['Dockerfile'][1]
-        render_template(dst_file, dst_file, port=self.port)
+        variables = super().dockerfile_variables(tz, distros, python)
+        variables['port'] = self.port
+        return variables
 
     def cgit_config(self):
         # ${title}, ${description}, ${max-repo-count},${service_name}
+        host = '{}:{}'.format(self.host, self.port)
+        schema = 'http'
+        host = host if host.startswith('http') else schema+'://{}'.format(host)
+        template_file = self.templates_mapping['Cgit_Config'][0]
+        dst_template = compile_template(self.templates_mapping['Cgit_Config'][1])
         for service_name, service in self.services.items():
-            if 'cgit_options' in service.keys():
-                host = '{}:{}'.format(self.host, self.port)
-                schema = 'http'
-                host = host if host.startswith('http') else schema+'://{}'.format(host)
+            if 'cgit_options' in service.keys() and self.is_target(service_name):
                 title = service['cgit_options']['title']
                 description = service['cgit_options']['description']
                 max_repo_count = service['cgit_options']['max-repo-count']
-                template_file = self.templates_mapping['Cgit_Config'][0]
-                dst_file = self.templates_mapping['Cgit_Config'][1]
-                dst_file = string.Template(dst_file).safe_substitute(service_name=service_name)
-                render_template(template_file, dst_file, title=title, description=description,
-                                max_repo_count=max_repo_count, service_name=service_name, host=host)
+                # room for the index pages and the pages of the repositories listed
+                cache_size = service['cgit_options'].get('cache-size', max(1000, 10 * max_repo_count))
+                ttls = {option.replace('-', '_'): service['cgit_options'].get(option, default)
+                        for option, default in CGIT_CACHE_TTLS.items()}
+                dst_file = dst_template.safe_substitute(service_name=service_name)
+                self.render_template(template_file, dst_file, service_name, title=title, description=description,
+                                     max_repo_count=max_repo_count, service_name=service_name, host=host,
+                                     enable_http_clone=0 if self.smart_http else 1, cache_size=cache_size,
+                                     clone_url='\nclone-url={}/{}/$CGIT_REPO_URL'.format(host, service_name)
+                                     if self.smart_http else "",
+                                     css=self.asset('/cgit/default/cgit.css'),
+                                     logo=self.asset('/cgit/default/cgit.png'),
+                                     favicon=self.asset('/cgit/default/favicon.ico'), **ttls)
+
+    def asset(self, url):
+        return self.assets.get(url, url)
+
+    def fingerprint_assets(self):
+        """
+        Copy the static cgit files and the logos of the services next to
+        themselves, with the hash of their content in their name, and write
+        the map of their urls to assets.json. The pages refer to the hashed
+        names, cached for good by the browsers: a changed file gets a new name.
+        """
+        self.assets = {}
+        if not self.cgit:
+            return
+        cgit_dir = self.settings.get("CGIT_STATICS", "")
+        template_cgit_dir = join(self.settings.get("TEMPLATES_DIR", ""), self.__class__.__name__, "www", "cgit")
+        for root, dirs, files in os.walk(template_cgit_dir):
+            dirs.sort()
+            for name in sorted(files):
+                if name in UNHASHED_ASSETS:
+                    continue
+                src = join(root, name)
+                path = os.path.relpath(src, template_cgit_dir).replace("\\", "/")
+                hashed_path = _hashed_name(path, hash_file(src))
+                self.copy_asset(src, join(cgit_dir, hashed_path))
+                self.assets['/cgit/' + path] = '/cgit/' + hashed_path
+        for service_name, service in self.services.items():
+            if 'cgit_options' in service.keys() and 'logo' in service['cgit_options']:
+                for theme in ['light', 'dark']:
+                    src = service['cgit_options']['logo'][theme]
+                    path = '%s/logo-%s.png' % (service_name, theme)
+                    hashed_path = _hashed_name(path, hash_file(src))
+                    # the logos of the other services are left as they are, they stay in the map
+                    if self.is_target(service_name):
+                        self.copy_asset(src, join(cgit_dir, hashed_path), service_name)
+                    self.assets['/cgit/' + path] = '/cgit/' + hashed_path
+        self.write_file(join(cgit_dir, 'assets.json'), json.dumps(self.assets, indent=2, sort_keys=True) + '\n')
+
+    def head_option(self):
+        # ${jquery}, ${magic}, ${assets}
+        if not self.cgit:
+            return
+        template_file = self.templates_mapping['Head_Option'][0]
+        dst_file = self.templates_mapping['Head_Option'][1]
+        self.render_template(template_file, dst_file, jquery=self.asset('/cgit/js/jquery-3.5.0.min.js'),
+                             magic=self.asset('/cgit/js/magic.js'), assets=json.dumps(self.assets, sort_keys=True))
+
+    def fastcgi_cache_path(self):
+        if 'fastcgi_cache' not in self.cgit_cache or not self.cgit:
+            return ""
+        options = dict(FASTCGI_CACHE_DEFAULTS, **self.cgit_cache['fastcgi_cache'])
+        return "fastcgi_cache_path /var/cache/cgit/_nginx levels=1:2 keys_zone=cgit:10m " \
+               "max_size=%s inactive=%s use_temp_path=off;\n\n" % (options['max_size'], options['inactive'])
+
+    def fastcgi_cache(self, indent):
+        """The directives caching the cgit pages in the nginx zone, serving stale ones while one request updates them"""
+        if 'fastcgi_cache' not in self.cgit_cache:
+            return ""
+        options = dict(FASTCGI_CACHE_DEFAULTS, **self.cgit_cache['fastcgi_cache'])
+        return "".join("\n" + " " * indent + directive for directive in (
+            "fastcgi_cache cgit;",
+            "fastcgi_cache_key $scheme$host$request_uri;",
+            "fastcgi_cache_valid 200 %s;" % options['valid'],
+            "fastcgi_cache_lock on;",
+            "fastcgi_cache_use_stale error timeout updating http_500 http_503;",
+            "fastcgi_cache_background_update on;"))
+
+    def git_http_location(self, service_name, prefix=''):
+        """The location passing the smart HTTP clones of *service_name* under *prefix* to git-http-backend"""
+        if not self.smart_http:
+            return ""
+        git_http_backend = '/usr/libexec/git-core/git-http-backend' if self.image == 'alpine' \
+            else '/usr/lib/git-core/git-http-backend'
+        # the mirrors belong to the host user, not to the fcgiwrap one: only the ones of the service
+        # are trusted, and the path segments can't climb out of it or reach hidden directories
+        return "\n  location ~ ^%s(?<git_path>(/\\w[\\w.-]*)+/(info/refs|git-upload-pack))$ {\n" \
+               "      client_max_body_size 0;\n" \
+               "      fastcgi_buffering off;\n" \
+               "      include /etc/nginx/fastcgi_params;\n" \
+               "      fastcgi_param PATH_INFO $git_path;\n" \
+               "      fastcgi_param GIT_PROJECT_ROOT /srv/git/%s;\n" \
+               "      fastcgi_param GIT_HTTP_EXPORT_ALL \"\";\n" \
+               "      fastcgi_param GIT_CONFIG_COUNT 1;\n" \
+               "      fastcgi_param GIT_CONFIG_KEY_0 safe.directory;\n" \
+               "      fastcgi_param GIT_CONFIG_VALUE_0 /srv/git/%s/*;\n" \
+               "      fastcgi_param SCRIPT_FILENAME %s;\n" \
+               "      fastcgi_pass unix:/run/fcgiwrap.socket;\n" \
+               "  }" % (prefix, service_name, service_name, git_http_backend)
 
     def nginx_default(self):
         # ${nginx_service} ${port}
         template_file = self.templates_mapping['Nginx_Default'][0]
         dst_file = self.templates_mapping['Nginx_Default'][1]
         nginx_service = ""
+        if self.cgit and self.cgit_mode == 'fastcgi':
+            nginx_service += "\n  location ^~ /cgit/ {\n" \
+                             "      root /var/www;\n" \
+                             "      expires 30d;\n" \
+                             "      location %s {\n" \
+                             "          expires off;\n" \
+                             "          %s\n" \
+                             "      }\n" \
+                             "  }" % (HASHED_ASSET_LOCATION, IMMUTABLE_CACHE)
+        elif self.cgit:
+            # the cgit pages behind the proxy load their static files from this server
+            nginx_service += "\n  location %s {\n" \
+                             "      root /var/www;\n" \
+                             "      %s\n" \
+                             "  }" % (HASHED_ASSET_LOCATION, IMMUTABLE_CACHE)
         for service_name, service in self.services.items():
-            if 'cgit_options' in service.keys():
+            if 'cgit_options' in service.keys() and self.cgit_mode == 'fastcgi':
+                # before the location of cgit, the first regex matching wins
+                nginx_service += self.git_http_location(service_name, '/' + service_name)
+                nginx_service += "\n  location ~ ^/%s(?<cgit_path>/.*)$ {\n" \
+                                 "      access_log /var/log/nginx/%s/access.log;\n" \
+                                 "      error_log /var/log/nginx/%s/error.log;\n" \
+                                 "      include /etc/nginx/fastcgi_params;\n" \
+                                 "      fastcgi_param PATH_INFO    $cgit_path;\n" \
+                                 "      fastcgi_param QUERY_STRING $args;\n" \
+                                 "      fastcgi_param CGIT_CONFIG  /etc/cgitrc.d/%s.cgit.com;\n" \
+                                 "      fastcgi_param SCRIPT_FILENAME /usr/lib/cgit/cgit.cgi;\n" \
+                                 "      fastcgi_pass unix:/run/fcgiwrap.socket;%s\n" \
+                                 "  }" % (service_name, service_name, service_name, service_name,
+                                          self.fastcgi_cache(6))
+            elif 'cgit_options' in service.keys():
+                # the fetch negotiations and the packs of the clones go through the proxy unbuffered
+                git_http = "      client_max_body_size 0;\n" \
+                           "      proxy_buffering off;\n" if self.smart_http else ""
                 nginx_service += "\n  location /%s/ {\n" \
+                                 "%s" \
                                  "      proxy_pass http://%s.cgit.com:%s/;\n" \
-                                 "  }" % (service_name, service_name, str(self.port))
+                                 "  }" % (service_name, git_http, service_name, str(self.port))
             else:
                 index = "index index.html;"
                 if 'autoindex' in service.keys() and service['autoindex']:
@@ -113,16 +295,21 @@ class Web(DevSpaceServer):
                                  "      %s\n" \
                                  "  }" % (service_name, service_name, index)
 
-        render_template(template_file, dst_file, nginx_service=nginx_service, port=self.port)
+        self.render_template(template_file, dst_file, nginx_service=nginx_service, port=self.port,
+                             fastcgi_cache_path=self.fastcgi_cache_path())
 
     def nginx_cgit_config(self):
         # ${service_name} ${port}
+        if self.cgit_mode != 'proxy':
+            return
+        template_file = self.templates_mapping['Nginx_Config'][0]
+        dst_template = compile_template(self.templates_mapping['Nginx_Config'][1])
         for service_name, service in self.services.items():
-            if 'cgit_options' in service.keys():
-                template_file = self.templates_mapping['Nginx_Config'][0]
-                dst_file = self.templates_mapping['Nginx_Config'][1]
-                dst_file = string.Template(dst_file).safe_substitute(service_name=service_name)
-                render_template(template_file, dst_file, service_name=service_name, port=self.port)
+            if 'cgit_options' in service.keys() and self.is_target(service_name):
+                dst_file = dst_template.safe_substitute(service_name=service_name)
+                self.render_template(template_file, dst_file, service_name, service_name=service_name, port=self.port,
+                                     git_http=self.git_http_location(service_name) + "\n" if self.smart_http else "",
+                                     fastcgi_cache=self.fastcgi_cache(4))
 
     def index(self):
         template_file = self.templates_mapping['Index'][0]
@@ -135,21 +322,23 @@ class Web(DevSpaceServer):
             else:
                 services += '<li><a href="/%s/">%s</a></li>\n' % (service_name, service_name)
         services += "</ul>\n</li>\n" + cgit_services + "</ul>\n</li>\n"
-        render_template(template_file, dst_file, services=services)
+        favicon = '\n<link rel="icon" href="%s">' % self.asset('/cgit/default/favicon.ico') if self.cgit else ""
+        self.render_template(template_file, dst_file, services=services, favicon=favicon)
 
     def copy_logo(self):
         project_dir = self.settings['project']['path']
         if not project_dir:
             raise ValueError("Can't get Template or Project directory from setting")
         for service_name, service in self.services.items():
-            if 'cgit_options' in service.keys() and 'logo' in service['cgit_options']:
+            if 'cgit_options' in service.keys() and 'logo' in service['cgit_options'] and \
+                    self.is_target(service_name):
                 dst = normpath(project_dir + '/www/cgit/' + service_name)
                 if not exists(dst):
                     os.makedirs(dst)
                 for theme in ['light', 'dark']:
                     src = service['cgit_options']['logo'][theme]
                     dst_logo = join(dst, 'logo-%s.png' % theme)
-                    copy2(src, dst_logo)
+                    self.copy_asset(src, dst_logo, service_name)
 
     def create_server_structure(self):
         self.create_server_base_structure(ignore_patterns('*.template', 'www'))
@@ -159,7 +348,7 @@ class Web(DevSpaceServer):
         os.makedirs(www_dir, exist_ok=True)
         if self.cgit:
             cgit_dir = self.settings.get("CGIT_STATICS", "")
-            copytree(join(template_srv_dir, "www", "cgit"), cgit_dir)
+            copytree(join(template_srv_dir, "www", "cgit"), cgit_dir, copy_function=self.copy_asset)
         # make log root
         log_dir = join(self.settings.get("SHARED_LOG", ""), self.server_name)
         os.makedirs(log_dir, exist_ok=True)
@@ -176,25 +365,40 @@ class Web(DevSpaceServer):
             # make data
             os.makedirs(join(data_dir, service_name), exist_ok=True)
 
-    def render(self):
+    def render_server(self):
         self.create_server_structure()
+        self.fingerprint_assets()
         self.dockerfile()
         self.cgit_config()
+        self.head_option()
         self.nginx_default()
         self.nginx_cgit_config()
         self.index()
         self.copy_logo()
 
+    def render(self, changed=False):
+        super().render(changed)
+        # once the stale outputs are pruned, the siblings of the replaced hashed copies go with them
+        if self.settings.get_bool('PRECOMPRESS'):
+            # the published docs under services are compressed by their publish
+            written = precompress(self.settings.get("SHARED_WEB", ""),
+                                  join(self.settings['PRECOMPRESS_RECORDS'], 'www.json'),
+                                  int(self.settings.get('PRECOMPRESS_JOBS', 0)), exclude=('services',))
+            if written:
+                print("{}: {} files precompressed".format(self.server_name, written))
+
     def generate_docker_compose_service(self):
         template_file = self.templates_mapping['DockerCompose'][0]
-        with open(template_file, 'rb') as fp:
-            raw = fp.read().decode('utf8')
-            content = string.Template(raw).safe_substitute(
-                server_name=(self.settings['project']['name'] +'_' + self.server_name).lower(),
-                port=self.port)
+        content = get_template(template_file).safe_substitute(
+            server_name=(self.settings['project']['name'] +'_' + self.server_name).lower(),
+            port=self.port)
         service_content = yaml.safe_load(content)
         for service_name, service in self.services.items():
             if 'cgit_options' in service.keys():
                 service_content['web']['volumes'].append('./data/{}:/srv/git/{}:ro'.format(service_name, service_name))
+        tmpfs = self.cgit_cache.get('tmpfs', CGIT_CACHE_TMPFS)
+        if self.cgit and tmpfs:
+            # the caches are rebuilt from the mirrors, they don't need to survive a restart
+            service_content['web']['tmpfs'] = ['/var/cache/cgit:size={},mode=1777'.format(tmpfs)]
         content = yaml.safe_dump(service_content)
         return content if content else ''
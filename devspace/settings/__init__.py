@@ -6,6 +6,10 @@ from importlib import import_module
 from devspace.utils.misc import walk_modules
 from devspace.exceptions import ConfigurationError
 
+# settings holding a ${PROJECT_DIR} placeholder, resolved once the project is known
+PROJECT_PATH_SETTINGS = ('SHARED_WEB', 'SHARED_DATA', 'SHARED_LOG', 'CGIT_STATICS', 'RENDER_MANIFEST', 'LOCKS_DIR',
+                         'PRECOMPRESS_RECORDS')
+
 
 class Settings:
     def __init__(self, values=None):
@@ -50,23 +54,15 @@ class Settings:
     def update(self, values):
         if isinstance(values, str):
             values = json.loads(values)
-            if values is not None:
-                for name, value in values.items():
-                    self.set(name, value)
-                    if name == "project":
-                        if isinstance(value['path'], str):
-                            project_dir = value['path']
-                            self.attributes['SHARED_WEB'] = os.path.normpath(
-                                string.Template(self.attributes['SHARED_WEB']).substitute(PROJECT_DIR=project_dir)).\
-                                replace('\\', '/')
-                            self.attributes['SHARED_DATA'] = os.path.normpath(
-                                string.Template(self.attributes['SHARED_DATA']).substitute(PROJECT_DIR=project_dir)). \
-                                replace('\\', '/')
-                            self.attributes['SHARED_LOG'] = os.path.normpath(
-                                string.Template(self.attributes['SHARED_LOG']).substitute(PROJECT_DIR=project_dir)). \
-                                replace('\\', '/')
-                            self.attributes['CGIT_STATICS'] = os.path.normpath(
-                                string.Template(self.attributes['CGIT_STATICS']).substitute(PROJECT_DIR=project_dir)). \
+        if values is not None:
+            for name, value in values.items():
+                self.set(name, value)
+                if name == "project":
+                    if isinstance(value['path'], str):
+                        project_dir = value['path']
+                        for key in PROJECT_PATH_SETTINGS:
+                            self.attributes[key] = os.path.normpath(
+                                string.Template(self.attributes[key]).substitute(PROJECT_DIR=project_dir)).\
                                 replace('\\', '/')
 
     def get(self, name, default=None):
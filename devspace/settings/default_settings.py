@@ -1,5 +1,6 @@
 # -*- coding: UTF-8 -*-
-from os.path import join, abspath, dirname
+import os
+from os.path import join, abspath, dirname, expanduser
 
 # Log
 LOG_ENABLED = True
@@ -35,3 +36,53 @@ SHARED_WEB = "${PROJECT_DIR}/www"
 SHARED_DATA = "${PROJECT_DIR}/data"
 SHARED_LOG = "${PROJECT_DIR}/log"
 CGIT_STATICS = join(SHARED_WEB, 'cgit')
+CACHE_DIR = join(os.environ.get('XDG_CACHE_HOME') or join(expanduser('~'), '.cache'), 'devspace')
+COMMANDS_INDEX = join(CACHE_DIR, 'commands.json')
+VALIDATORS_DIR = join(CACHE_DIR, 'validators')
+APPS_CACHE = join(CACHE_DIR, 'apps')  # bare clones of the server apps shared by all projects
+UPDATE_APPS = False  # fast-forward the apps already installed when rendering
+RENDER_MANIFEST = "${PROJECT_DIR}/.devspace/render-manifest.json"
+LOCKS_DIR = "${PROJECT_DIR}/.devspace/locks"
+SETTINGS_CACHE = ".devspace/settings.cache"  # relative to the project file
+SERVICES_DIR = "services.d"  # relative to the project file, one <service_name>.json per service
+FRAGMENTS_CACHE = ".devspace/fragments.cache"  # relative to the project file
+# how read-only assets (cgit statics, logos) get into the project: copy, hardlink or reflink,
+# files already holding the right content are kept as they are when the mode changes
+COPY_MODE = "copy"
+
+# write the .gz (and .br with brotli installed) siblings of the text files of SHARED_WEB for
+# gzip_static, after rendering Web and after publishing docs, PRECOMPRESS_JOBS at a time or one per core
+PRECOMPRESS = True
+PRECOMPRESS_JOBS = 0
+# the lists of the siblings written, only those are replaced or removed
+PRECOMPRESS_RECORDS = "${PROJECT_DIR}/.devspace/precompress"
+
+# spread the '*/k' synchronization crontabs of the services over the k minutes, at an offset
+# taken from a hash of the server and service names
+STAGGER_CRONTABS = True
+
+# Mirror
+MIRROR_JOBS = 8  # repositories fetched concurrently
+MIRROR_HOST_JOBS = 4  # repositories fetched concurrently from the same upstream host
+MIRROR_RETRIES = 2
+MIRROR_RETRY_BACKOFF = 2  # seconds before the first retry, doubled at each retry
+MIRROR_TIMEOUT = 3600  # seconds for a clone or a fetch, 0 for no limit
+# check each repository at an interval adapted to how often it changes,
+# between MIRROR_MIN_INTERVAL and MIRROR_MAX_INTERVAL seconds
+MIRROR_ADAPTIVE = False
+MIRROR_MIN_INTERVAL = 300
+MIRROR_MAX_INTERVAL = 86400
+# the cgit repository list of a service is split in one include file per section
+# above this number of repositories, 0 to keep a single file
+CGIT_REPO_SHARD_SIZE = 1000
+
+# Documentation pipelines run on the host
+DOCS_JOBS = 0  # pipelines run concurrently, 0 for one per core
+DOCS_STEP_JOBS = 0  # build steps of a pipeline run concurrently, 0 for one per core
+DOCS_TIMEOUT = 3600  # seconds for the checkout, the build or a build step, 0 for no limit
+DOCS_SPHINX_OPTS = "-j auto"  # added to the SPHINXOPTS of the sphinx builds
+
+# Maintenance of the mirrors
+MAINTAIN_JOBS = 1  # mirrors maintained concurrently
+MAINTAIN_NICE = 10  # niceness of the git maintenance commands
+MAINTAIN_BUDGET = 0  # seconds per run, 0 for no limit
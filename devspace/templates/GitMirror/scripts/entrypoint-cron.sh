@@ -34,13 +34,18 @@ if [ "$distribution" = "alpine" ]; then
 
   adduser --disabled-password --home /home/yang --gecos "" --shell /bin/sh --uid $USER_ID yang
   su-exec yang ./gitmirror.py --autoconf
-  su-exec yang ./gitmirror.py --init
+  # the databases are built by devspace render, only SQL scripts left by other means are replayed
+  if ls database/*.sql >/dev/null 2>&1; then
+    su-exec yang ./gitmirror.py --init
+  fi
   exec su-exec yang "$@"
 else
   service cron start
 
   useradd --shell /bin/bash -u $USER_ID -o -c "" -m yang
   /usr/sbin/gosu yang ./gitmirror.py --autoconf
-  /usr/sbin/gosu yang ./gitmirror.py --init
+  if ls database/*.sql >/dev/null 2>&1; then
+    /usr/sbin/gosu yang ./gitmirror.py --init
+  fi
   exec /usr/sbin/gosu yang "$@"
 fi
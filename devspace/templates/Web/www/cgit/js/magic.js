@@ -1,3 +1,11 @@
+// the content-hashed name of a static file, see cgit_assets in head_option
+function asset(path) {
+  if (window.cgit_assets && cgit_assets[path]) {
+    return cgit_assets[path]
+  }
+  return path
+}
+
 function setTheme() {
   var storage = window.localStorage;
   if (storage['theme'] == "light") {
@@ -40,12 +48,12 @@ function magic() {
     }
     if (storage['theme'] == "light") {
       button_text = 'dark theme'
-      logo_img = '/cgit/'+repo+'/logo-light.png'
-      css_file = '/cgit/css/cgit-light.css'
+      logo_img = asset('/cgit/'+repo+'/logo-light.png')
+      css_file = asset('/cgit/css/cgit-light.css')
     } else {
       button_text = 'light theme'
-      logo_img = '/cgit/'+repo+'/logo-dark.png'
-      css_file = '/cgit/css/cgit-dark.css'
+      logo_img = asset('/cgit/'+repo+'/logo-dark.png')
+      css_file = asset('/cgit/css/cgit-dark.css')
     }
     $(document).ready(function() {
       removeCSS()
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import json
+import sqlite3
+from os.path import join
+from collections import Counter
+
+# bumped, with a migration in open_database, whenever the tables change
+SCHEMA_VERSION = 5
+
+# rows inserted by render have never been checked by the mirror
+NEVER_CHECKED = '1970-01-01 00:00:00'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS Configurations (
+  service_name TEXT UNIQUE PRIMARY KEY NOT NULL,
+  host TEXT NOT NULL,
+  consistency INTEGER NOT NULL DEFAULT (0),
+  crontab TEXT NOT NULL,
+  repositories TEXT NOT NULL,
+  original_sql TEXT
+);
+CREATE TABLE IF NOT EXISTS Repositories (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  name TEXT NOT NULL,
+  section TEXT,
+  owner TEXT,
+  descriptions TEXT,
+  html_url TEXT NOT NULL,
+  clone_url TEXT UNIQUE NOT NULL,
+  target_url TEXT,
+  source TEXT NOT NULL,
+  source_type TEXT,
+  last_check DATETIME NOT NULL,
+  last_update DATETIME,
+  check_interval INTEGER,
+  next_check DATETIME
+);
+-- clone_url is indexed by its UNIQUE constraint
+CREATE INDEX IF NOT EXISTS Repositories_source ON Repositories (source);
+CREATE INDEX IF NOT EXISTS Repositories_last_check ON Repositories (last_check);
+CREATE INDEX IF NOT EXISTS Repositories_next_check ON Repositories (next_check);
+-- digest of the refs advertised by the upstream at the last fetch
+CREATE TABLE IF NOT EXISTS RefTips (
+  repository_id INTEGER PRIMARY KEY NOT NULL,
+  tips TEXT NOT NULL
+);
+-- last git maintenance of each mirror, and how long it took in seconds
+CREATE TABLE IF NOT EXISTS Maintenance (
+  repository_id INTEGER PRIMARY KEY NOT NULL,
+  last_run DATETIME NOT NULL,
+  duration REAL NOT NULL
+);
+-- version of the cgit repository list, bumped by the triggers below when the
+-- repositories or their mirrors change, and the version last written
+CREATE TABLE IF NOT EXISTS RepoList (
+  id INTEGER PRIMARY KEY CHECK (id = 1),
+  version INTEGER NOT NULL DEFAULT (1),
+  written INTEGER NOT NULL DEFAULT (0)
+);
+INSERT OR IGNORE INTO RepoList (id) VALUES (1);
+CREATE TRIGGER IF NOT EXISTS RepoList_insert AFTER INSERT ON Repositories
+BEGIN UPDATE RepoList SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS RepoList_delete AFTER DELETE ON Repositories
+BEGIN UPDATE RepoList SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS RepoList_update AFTER UPDATE OF name, section, owner, descriptions ON Repositories
+BEGIN UPDATE RepoList SET version = version + 1; END;
+CREATE TRIGGER IF NOT EXISTS RepoList_mirror AFTER INSERT ON RefTips
+BEGIN UPDATE RepoList SET version = version + 1; END;
+"""
+
+# columns added to the tables after their creation, added to older databases
+ADDED_COLUMNS = {
+    'Repositories': [('check_interval', 'INTEGER'), ('next_check', 'DATETIME')]
+}
+
+SOURCE_URLS = {
+    'github': 'https://github.com/',
+    'gitee': 'https://gitee.com/'
+}
+
+
+def database_file(settings, service_name):
+    """The database of a GitMirror service, rendered into its container app"""
+    return join(settings['project']['path'], 'servers', 'GitMirror', 'apps', 'database', service_name + '.db')
+
+
+def open_database(database_file):
+    """Open the database of a GitMirror service, creating or migrating its tables"""
+    conn = sqlite3.connect(database_file)
+    conn.execute("PRAGMA journal_mode = WAL")
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        with conn:
+            for table, columns in ADDED_COLUMNS.items():
+                existing = [row[1] for row in conn.execute("PRAGMA table_info({})".format(table))]
+                for column, column_type in columns:
+                    if existing and column not in existing:
+                        conn.execute("ALTER TABLE {} ADD COLUMN {} {}".format(table, column, column_type))
+            conn.executescript(SCHEMA)
+            conn.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+    return conn
+
+
+def mirror_name(name):
+    """The name of the mirror of a repository, in the data directory of its service: <mirror_name>.git"""
+    return name[:-len('.git')] if name.endswith('.git') else name
+
+
+def shared_mirror_names(conn):
+    """The mirror names of several repositories, e.g. the same name under two owners, which would share a mirror"""
+    counts = Counter(mirror_name(name) for name, in conn.execute("SELECT name FROM Repositories"))
+    return {name for name, count in counts.items() if count > 1}
+
+
+def known_repositories(repositories):
+    """
+    The repositories named in the settings, as Repositories rows: the github
+    and gitee ``owner/repo`` sources. Owners and cgit sources are listed by the
+    mirror itself.
+    """
+    for source_type, source_url in SOURCE_URLS.items():
+        for repository in repositories.get(source_type, []):
+            source = repository['source']
+            if '/' not in source:
+                continue
+            owner, name = source.split('/', 1)
+            html_url = source_url + source
+            yield name, owner, html_url, html_url + '.git', source, source_type, NEVER_CHECKED
+
+
+def excluded_urls(repositories):
+    for source_type, sources in repositories.items():
+        for repository in sources:
+            for exclude in repository['excludes']:
+                url = exclude if source_type == 'cgit' else SOURCE_URLS[source_type] + exclude
+                yield url.rstrip('/'),
+
+
+def _sources(repositories):
+    return {repository['source'] for sources in repositories.values() for repository in sources}
+
+
+def update_service(conn, service_name, host, consistency, crontab, repositories):
+    """
+    Store the configuration of a service and its known repositories. The
+    repositories already mirrored keep their last_check and last_update, the
+    ones of the sources removed from the configuration are deleted.
+
+    Returns False when the stored configuration is already up to date.
+    """
+    configuration = json.dumps(repositories, sort_keys=True)
+    row = conn.execute("SELECT host, consistency, crontab, repositories FROM Configurations "
+                       "WHERE service_name = ?", (service_name,)).fetchone()
+    if row == (host, consistency, crontab, configuration):
+        return False
+    try:
+        previous = json.loads(row[3]) if row else {}
+    except ValueError:
+        previous = {}
+    with conn:
+        conn.execute("INSERT INTO Configurations (service_name, host, consistency, crontab, repositories, "
+                     "original_sql) VALUES (?, ?, ?, ?, ?, '') "
+                     "ON CONFLICT (service_name) DO UPDATE SET host = excluded.host, "
+                     "consistency = excluded.consistency, crontab = excluded.crontab, "
+                     "repositories = excluded.repositories",
+                     (service_name, host, consistency, crontab, configuration))
+        conn.executemany("INSERT INTO Repositories (name, owner, html_url, clone_url, source, source_type, "
+                         "last_check) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                         "ON CONFLICT (clone_url) DO UPDATE SET name = excluded.name, owner = excluded.owner, "
+                         "html_url = excluded.html_url, source = excluded.source, "
+                         "source_type = excluded.source_type",
+                         known_repositories(repositories))
+        conn.executemany("DELETE FROM Repositories WHERE source = ?",
+                         ((source,) for source in sorted(_sources(previous) - _sources(repositories))))
+        conn.executemany("DELETE FROM Repositories WHERE rtrim(html_url, '/') = ?", excluded_urls(repositories))
+        conn.execute("DELETE FROM RefTips WHERE repository_id NOT IN (SELECT id FROM Repositories)")
+        conn.execute("DELETE FROM Maintenance WHERE repository_id NOT IN (SELECT id FROM Repositories)")
+    return True
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import hashlib
+import subprocess
+from shutil import rmtree, which
+from devspace.exceptions import GitError
+from devspace.utils.misc import file_lock
+
+
+def git(*args, cwd=None):
+    """Run a git command quietly, return whether it succeeded"""
+    ret = subprocess.run(["git"] + list(args), cwd=cwd, stdout=subprocess.DEVNULL)
+    return ret.returncode == 0
+
+
+def run_git(*args, cwd=None, timeout=None, niceness=0):
+    """Run a git command without prompting for credentials, return its output.
+    Raise GitError on failure. A *niceness* lowers the priority of the command.
+    """
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    command = ["git"] + list(args)
+    if niceness and which("nice"):
+        command = ["nice", "-n", str(niceness)] + command
+    try:
+        ret = subprocess.run(command, cwd=cwd, env=env, timeout=timeout,
+                             stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+    except subprocess.TimeoutExpired:
+        raise GitError("git {} timed out after {}s".format(args[0], timeout))
+    if ret.returncode != 0:
+        errors = [line.strip() for line in ret.stderr.splitlines() if line.strip()]
+        fatal = [line for line in errors if line.startswith(('fatal:', 'error:'))]
+        raise GitError((fatal or errors or ["git {} failed".format(args[0])])[0])
+    return ret.stdout
+
+
+# the file cgit reads the idle time of a repository from, see agefile in cgitrc
+AGEFILE = os.path.join('info', 'web', 'last-modified')
+
+
+def write_agefile(git_dir):
+    """
+    Write the date of the latest commit of *git_dir* in its cgit agefile,
+    atomically. Returns False when the repository has no commit or the
+    agefile is already up to date.
+    """
+    last_modified = run_git("for-each-ref", "--sort=-committerdate", "--count=1",
+                            "--format=%(committerdate:iso8601)", cwd=git_dir).strip()
+    if not last_modified:
+        return False
+    agefile = os.path.join(git_dir, AGEFILE)
+    try:
+        with open(agefile, 'r') as f:
+            if f.read().strip() == last_modified:
+                return False
+    except OSError:
+        pass
+    os.makedirs(os.path.dirname(agefile), exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(agefile, os.getpid())
+    with open(tmp_file, 'w') as f:
+        f.write(last_modified + '\n')
+    os.replace(tmp_file, agefile)
+    return True
+
+
+def iter_git_dirs(path):
+    """Yield the bare repositories found under *path*"""
+    try:
+        with os.scandir(path) as it:
+            entries = [entry for entry in it if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        return
+    for entry in sorted(entries, key=lambda entry: entry.name):
+        if entry.name.endswith('.git') and os.path.isfile(os.path.join(entry.path, 'HEAD')):
+            yield entry.path
+        else:
+            yield from iter_git_dirs(entry.path)
+
+
+def mirror_path(src, cache_dir):
+    return os.path.join(cache_dir, hashlib.sha1(src.encode('utf8')).hexdigest() + '.git')
+
+
+def update_mirror(src, cache_dir):
+    """
+    Clone *src* once as a bare repository in *cache_dir*, and fetch its branches
+    and tags incrementally afterwards. Returns the path of the bare repository.
+
+    When the fetch fails but a previous copy is cached, the cached copy is used.
+    """
+    mirror = mirror_path(src, cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    with file_lock(mirror + '.lock'):
+        if os.path.isdir(mirror):
+            if not git("--git-dir", mirror, "fetch", "--quiet", "--prune", "--tags", "origin"):
+                print("Warning: fetch {} failed, using the cached copy".format(src))
+            return mirror
+        tmp_mirror = mirror + '.tmp'
+        if os.path.exists(tmp_mirror):
+            rmtree(tmp_mirror)
+        if not git("clone", "--quiet", "--bare", src, tmp_mirror) or \
+                not git("--git-dir", tmp_mirror, "config", "remote.origin.fetch", "+refs/heads/*:refs/heads/*"):
+            raise RuntimeError("Clone app failed, please try render again")
+        os.replace(tmp_mirror, mirror)
+    return mirror
+
+
+def clone_app(src, apps_dir, cache_dir=''):
+    """
+    Clone *src* into *apps_dir*. With a *cache_dir*, the clone is made locally
+    from the cached bare repository: its objects are hard linked when on the
+    same filesystem, and *apps_dir* stays a standalone repository usable in
+    the containers. origin still points to *src*.
+    """
+    if not cache_dir:
+        if not git("clone", "--quiet", src, apps_dir):
+            raise RuntimeError("Clone app failed, please try render again")
+        return
+    mirror = update_mirror(src, cache_dir)
+    if not git("clone", "--quiet", mirror, apps_dir) or \
+            not git("remote", "set-url", "origin", src, cwd=apps_dir):
+        raise RuntimeError("Clone app failed, please try render again")
+
+
+def update_app(src, apps_dir, cache_dir=''):
+    """Fast-forward the app cloned in *apps_dir* to the latest *src*"""
+    remote = update_mirror(src, cache_dir) if cache_dir else src
+    if not git("fetch", "--quiet", "--tags", remote, "+refs/heads/*:refs/remotes/origin/*", cwd=apps_dir):
+        raise RuntimeError("Fetch app failed, please try render again")
+    if not git("merge", "--quiet", "--ff-only", "@{upstream}", cwd=apps_dir):
+        raise RuntimeError("Can't fast-forward {}, please update it by hand".format(apps_dir))
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import hashlib
+import threading
+from shutil import copy2
+
+_save_lock = threading.Lock()
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def hash_file(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_inputs(*files, **variables):
+    """Digest of the inputs that produce an output: the identity of each
+    source file (path, size, mtime) plus the substitution variables.
+    """
+    digest = hashlib.sha256()
+    for path in files:
+        st = os.stat(path)
+        digest.update('{}:{}:{}\n'.format(path, st.st_size, st.st_mtime_ns).encode('utf8'))
+    digest.update(json.dumps(variables, sort_keys=True, default=str).encode('utf8'))
+    return digest.hexdigest()
+
+
+def _same_stat(src, dst):
+    # copies keep the modification time: a file of the same size and
+    # mtime is taken as a copy of the source without reading it
+    try:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+    return src_st.st_size == dst_st.st_size and src_st.st_mtime_ns == dst_st.st_mtime_ns
+
+
+class RenderManifest:
+    """
+    Records the outputs written by one server render, so that the next render
+    can leave unchanged files untouched and remove files no longer produced.
+
+    The manifest file is shared by all servers of a project, each server owns
+    the section stored under its name. A *partial* render only produces part
+    of the outputs: the services it targets, and the outputs shared by all
+    services. It keeps the records of the other services outputs.
+
+    Along with the outputs, the section holds the digest of the server
+    settings and of each service settings the outputs were rendered from,
+    which tells the services changed since.
+    """
+
+    version = 2
+
+    def __init__(self, manifest_file, server_name, project_dir):
+        self.manifest_file = manifest_file
+        self.server_name = server_name
+        self.project_dir = project_dir
+        self.partial = False
+        self.previous = {}
+        self.outputs = {}
+        self.previous_server = ''
+        self.previous_services = {}
+        self.server = ''
+        self.services = {}
+        self.written = 0
+        self.skipped = 0
+        self.removed = 0
+        self.load()
+
+    def _key(self, path):
+        return os.path.relpath(path, self.project_dir).replace('\\', '/')
+
+    def _path(self, key):
+        return os.path.normpath(os.path.join(self.project_dir, key))
+
+    def _read(self):
+        try:
+            with open(self.manifest_file, 'r', encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != self.version:
+            return {}
+        return data
+
+    def load(self):
+        server = self._read().get('servers', {}).get(self.server_name, {})
+        self.previous = server.get('outputs', {})
+        self.previous_server = server.get('server', '')
+        self.previous_services = server.get('services', {})
+        self.server = self.previous_server
+        self.services = dict(self.previous_services)
+
+    def start(self, targets=None):
+        """Start recording the outputs of a render of the *targets* services, None for all"""
+        self.partial = targets is not None
+        self.outputs = {key: entry for key, entry in self.previous.items()
+                        if entry.get('service') is not None and entry['service'] not in targets} \
+            if self.partial else {}
+
+    def changed_services(self, server, services):
+        """Names of the services added, removed or changed since the recorded
+        render, or None when the server settings changed: everything is affected.
+        """
+        if not self.previous_server or server != self.previous_server:
+            return None
+        previous = self.previous_services
+        return {service_name for service_name in set(previous) | set(services)
+                if previous.get(service_name) != services.get(service_name)}
+
+    def is_fresh(self, path, inputs):
+        """Whether *path* was produced from *inputs* and not touched since,
+        so rendering it again can be skipped altogether.
+        """
+        entry = self.previous.get(self._key(path))
+        if not entry or not inputs or entry['inputs'] != inputs:
+            return False
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        return entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns
+
+    def keep(self, path, service=None):
+        """Record *path* as produced again without writing it"""
+        key = self._key(path)
+        self.outputs[key] = dict(self.previous[key])
+        self._set_service(key, service)
+        self.skipped += 1
+
+    def _is_unchanged(self, path, digest):
+        entry = self.previous.get(self._key(path))
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+        if entry and entry['hash'] == digest and \
+                entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return True
+        # not written by us, or touched since: compare the content itself
+        return hash_file(path) == digest
+
+    def _set_service(self, key, service):
+        if service is not None:
+            self.outputs[key]['service'] = service
+        else:
+            self.outputs[key].pop('service', None)
+
+    def _record(self, path, digest, inputs, service=None):
+        st = os.stat(path)
+        key = self._key(path)
+        self.outputs[key] = {
+            'hash': digest,
+            'inputs': inputs,
+            'size': st.st_size,
+            'mtime': st.st_mtime_ns
+        }
+        self._set_service(key, service)
+
+    def write(self, path, content, inputs='', service=None):
+        """Write *content* to *path* unless the file already holds it.
+        Return True when the file was written. *service* is the service
+        owning the output, None for an output shared by all services.
+        """
+        data = content.encode('utf8') if isinstance(content, str) else content
+        digest = hash_bytes(data)
+        if self._is_unchanged(path, digest):
+            self.skipped += 1
+            self._record(path, digest, inputs, service)
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fp:
+            fp.write(data)
+        self.written += 1
+        self._record(path, digest, inputs, service)
+        return True
+
+    def copy(self, src, dst, service=None, copy_function=copy2):
+        """Copy *src* to *dst* unless *dst* already holds the same content.
+        Return True when the file was copied. Usable as a copytree copy function.
+        """
+        inputs = hash_inputs(os.path.abspath(src))
+        if self.is_fresh(dst, inputs):
+            self.keep(dst, service)
+            return False
+        digest = hash_file(src)
+        if _same_stat(src, dst) or self._is_unchanged(dst, digest):
+            self.skipped += 1
+            self._record(dst, digest, inputs, service)
+            return False
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        copy_function(src, dst)
+        self.written += 1
+        self._record(dst, digest, inputs, service)
+        return True
+
+    def prune(self):
+        """Remove outputs recorded by the previous render but not produced by this one"""
+        for key in sorted(set(self.previous) - set(self.outputs)):
+            path = self._path(key)
+            if os.path.isfile(path):
+                os.remove(path)
+                self.removed += 1
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        with _save_lock:
+            data = self._read() or {'version': self.version, 'servers': {}}
+            data['servers'][self.server_name] = {'outputs': self.outputs, 'server': self.server,
+                                                 'services': self.services}
+            tmp_file = self.manifest_file + '.tmp'
+            with open(tmp_file, 'w', encoding="utf-8") as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+            os.replace(tmp_file, self.manifest_file)
+
+    def summary(self):
+        return "{}: {} written, {} skipped, {} removed".format(self.server_name, self.written,
+                                                               self.skipped, self.removed)
@@ -3,15 +3,30 @@
 
 import sys
 import os
-import string
 from importlib import import_module
 from pkgutil import iter_modules
 import re
 from urllib.parse import urlsplit
 import json
 import socket
-import jsonschema
-from shutil import copy2, copystat
+import errno
+import hashlib
+import marshal
+import devspace
+from shutil import copy2, copystat, copyfile
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from devspace.utils.template import get_template
+from devspace.utils.schema import load_validator, format_path
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ioctl cloning a file on copy-on-write filesystems (btrfs, xfs), from linux/fs.h
+FICLONE = 0x40049409
+COPY_MODES = ('copy', 'hardlink', 'reflink')
 
 
 def walk_modules(path):
@@ -85,26 +100,154 @@ def find_project_config(path='.', prev_path=None):
     return find_project_config(os.path.dirname(path), path)
 
 
+def _load_settings_cache(cache_file, key):
+    try:
+        with open(cache_file, 'rb') as f:
+            cached = marshal.load(f)
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    if not isinstance(cached, dict) or cached.get('key') != key:
+        return None
+    return cached['values']
+
+
+def _save_settings_cache(cache_file, key, values):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = '{}.{}.tmp'.format(cache_file, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            marshal.dump({'key': key, 'values': values}, f)
+        os.replace(tmp_file, cache_file)
+    except (OSError, ValueError):
+        pass  # the cache is only an optimization
+
+
+def get_project_validator(schema_file, raw_schema, settings, pointer='#'):
+    """Returns a function listing all the (path, message) errors of a value
+    against the project schema, or its sub-schema at *pointer*. Uses the
+    validator compiled from the schema, or jsonschema when it can't be compiled.
+    """
+    validator = load_validator(schema_file, settings.get('VALIDATORS_DIR', ''), pointer)
+    if validator is not None:
+        return validator.validate
+    import jsonschema
+    schema = json.loads(raw_schema.decode('utf-8'))
+    if pointer != '#':
+        schema = dict(schema, **{'$ref': pointer})
+    validator = jsonschema.Draft7Validator(schema)
+    return lambda values: [(tuple(e.path), e.message) for e in validator.iter_errors(values)]
+
+
+def _print_format_errors(errors, prefix=()):
+    for path, message in errors:
+        path = prefix + tuple(path)
+        print(" {}: {}".format(format_path(path), message) if path else " {}".format(message))
+
+
+def _load_fragment(fragment_file, validate):
+    try:
+        with open(fragment_file, 'rb') as f:
+            values = json.loads(f.read().decode('utf-8'))
+    except ValueError as e:
+        return None, [((), "Invalid JSON: {}".format(e))]
+    return values, validate(values)
+
+
+def load_service_fragments(services_dir, schema_file, raw_schema, settings):
+    """Loads the services declared one per file in *services_dir*, as
+    ``<service_name>.json`` holding what ``services.<service_name>`` would hold
+    in the project file.
+
+    Fragments are validated on their own and cached in FRAGMENTS_CACHE by
+    mtime, so only the fragments changed since the last run are parsed and
+    validated again, concurrently. Returns None when a fragment is invalid.
+    """
+    cache_file = os.path.join(os.path.dirname(services_dir), settings.get('FRAGMENTS_CACHE', ''))
+    key = '{}:{}:{}'.format(hashlib.sha256(raw_schema).hexdigest(), devspace.__version__, marshal.version)
+    cached = _load_settings_cache(cache_file, key) or {}
+    fragments = {}
+    stamps = {}
+    stale = {}
+    with os.scandir(services_dir) as it:
+        for entry in it:
+            if not entry.name.endswith('.json') or not entry.is_file():
+                continue
+            service_name = entry.name[:-len('.json')]
+            st = entry.stat()
+            stamps[service_name] = [st.st_mtime_ns, st.st_size]
+            if service_name in cached and cached[service_name][0] == stamps[service_name]:
+                fragments[service_name] = cached[service_name][1]
+            else:
+                stale[service_name] = entry.path
+
+    valid = True
+    for service_name in list(stale):
+        if not name_validator(service_name):
+            print("Wrong service fragment name: {}".format(stale.pop(service_name)))
+            valid = False
+    if stale:
+        validate = get_project_validator(schema_file, raw_schema, settings, '#/definitions/services')
+        with ThreadPoolExecutor() as executor:
+            results = executor.map(lambda fragment_file: _load_fragment(fragment_file, validate), stale.values())
+            for service_name, (values, errors) in zip(stale, results):
+                if errors:
+                    print("Wrong service fragment format: {}".format(stale[service_name]))
+                    _print_format_errors(errors, ('services', service_name))
+                    valid = False
+                fragments[service_name] = values
+    if not valid:
+        return None
+    if stale or set(cached) != set(fragments):
+        _save_settings_cache(cache_file, key, {service_name: [stamps[service_name], values]
+                                               for service_name, values in fragments.items()})
+    return fragments
+
+
 def get_project_settings(settings=None):
+    """Loads and validates the project file into *settings*.
+
+    The validated values are cached in SETTINGS_CACHE, next to the project
+    file, keyed by the hashes of the project file and of the schema: as long
+    as neither changes, validation and JSON parsing are skipped.
+
+    Services can also be declared one per file in the SERVICES_DIR directory
+    next to the project file, see load_service_fragments.
+    """
     conf_file = find_project_config()
     if settings and conf_file:
         schema_file = settings.get('PROJECT_SCHEMA', '')
         if not schema_file:
             print("Can't get schema file from setting")
             return False
-        with open(schema_file, 'r') as f:
-            schema = json.load(f)
-        with open(conf_file, 'r') as f:
-            data = json.load(f)
-        try:
-            jsonschema.validate(instance=data, schema=schema)
-            with open(conf_file, 'r', encoding="utf-8") as f:
-                values = f.read()
-                settings.set_dict(values)
-            return True
-        except jsonschema.exceptions.ValidationError as e:
-            print("Wrong project file format: \n {}".format(e.message))
-            return False
+        with open(schema_file, 'rb') as f:
+            raw_schema = f.read()
+        with open(conf_file, 'rb') as f:
+            raw_data = f.read()
+        key = '{}:{}:{}:{}'.format(hashlib.sha256(raw_data).hexdigest(), hashlib.sha256(raw_schema).hexdigest(),
+                                   devspace.__version__, marshal.version)
+        cache_file = os.path.join(os.path.dirname(conf_file), settings.get('SETTINGS_CACHE', ''))
+        values = _load_settings_cache(cache_file, key)
+        if values is None:
+            values = json.loads(raw_data.decode('utf-8'))
+            errors = get_project_validator(schema_file, raw_schema, settings)(values)
+            if errors:
+                print("Wrong project file format: ")
+                _print_format_errors(errors)
+                return False
+            _save_settings_cache(cache_file, key, values)
+        services_dir = os.path.join(os.path.dirname(conf_file), settings.get('SERVICES_DIR', ''))
+        if settings.get('SERVICES_DIR', '') and os.path.isdir(services_dir):
+            fragments = load_service_fragments(services_dir, schema_file, raw_schema, settings)
+            if fragments is None:
+                return False
+            duplicates = sorted(set(fragments) & set(values['services']))
+            if duplicates:
+                print("Services declared both in project file and in {}: {}".format(
+                    settings['SERVICES_DIR'], ', '.join(duplicates)))
+                return False
+            values['services'].update(sorted(fragments.items()))
+        settings.set_dict(values)
+        return True
     return False
 
 
@@ -137,39 +280,159 @@ def arglist_to_dict(arglist):
     return dict(x.split('=', 1) for x in arglist)
 
 
-def copytree(src, dst, ignore=None):
-    names = os.listdir(src)
+def copytree(src, dst, ignore=None, copy_function=copy2):
+    with os.scandir(src) as it:
+        entries = list(it)
     if ignore is not None:
-        ignored_names = ignore(src, names)
+        ignored_names = ignore(src, [entry.name for entry in entries])
     else:
         ignored_names = set()
 
-    if not os.path.exists(dst):
+    created = not os.path.isdir(dst)
+    if created:
         os.makedirs(dst)
 
-    for name in names:
-        if name in ignored_names:
+    for entry in entries:
+        if entry.name in ignored_names:
             continue
 
-        src_name = os.path.join(src, name)
-        dst_name = os.path.join(dst, name)
-        if os.path.isdir(src_name):
-            copytree(src_name, dst_name, ignore)
+        dst_name = os.path.join(dst, entry.name)
+        if entry.is_dir():
+            copytree(entry.path, dst_name, ignore, copy_function)
         else:
-            copy2(src_name, dst_name)
+            copy_function(entry.path, dst_name)
+    # existing directories are left as they are, re-renders write no metadata
+    if created:
+        copystat(src, dst)
+
+
+def _copy_file_range(src, dst):
+    """Copy the content of *src* to *dst* inside the kernel, without going
+    through user space. Returns False when the filesystems don't support it.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        try:
+            while remaining > 0:
+                copied = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+                if not copied:
+                    break
+                remaining -= copied
+        except OSError as e:
+            if e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM):
+                return False
+            raise
+    return True
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        return False
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            return False
     copystat(src, dst)
+    return True
 
 
-def render_template(template_path, dst_path, **kwargs):
-    with open(template_path, 'rb') as fp:
-        raw = fp.read().decode('utf8')
+def _hardlink(src, dst):
+    tmp_file = '{}.{}.tmp'.format(dst, os.getpid())
+    try:
+        os.link(src, tmp_file)
+    except OSError:
+        return False
+    os.replace(tmp_file, dst)
+    return True
+
+
+def fast_copy(src, dst, mode='copy'):
+    """Copies *src* to *dst* with its metadata like shutil.copy2, the content
+    is copied with copy_file_range, or sendfile when it's not supported.
+
+    The 'hardlink' *mode* links *dst* to *src* and the 'reflink' mode clones
+    *src* on copy-on-write filesystems, both only suit read-only assets and
+    fall back to a copy.
+    """
+    if os.path.lexists(dst):
+        try:
+            if mode == 'hardlink' and os.path.samefile(src, dst):
+                return dst
+        except OSError:
+            pass
+        # replace dst rather than writing through it, it may be a link to the source
+        os.remove(dst)
+    if mode == 'hardlink' and _hardlink(src, dst):
+        return dst
+    if mode == 'reflink' and _reflink(src, dst):
+        return dst
+    if not hasattr(os, 'copy_file_range') or not _copy_file_range(src, dst):
+        copyfile(src, dst)
+    copystat(src, dst)
+    return dst
+
 
-    content = string.Template(raw).safe_substitute(**kwargs)
+def substitute_template(template_path, **kwargs):
+    return get_template(template_path).safe_substitute(kwargs)
+
+
+def render_template(template_path, dst_path, **kwargs):
+    content = substitute_template(template_path, **kwargs)
 
     with open(dst_path, 'wb') as fp:
         fp.write(content.encode('utf8'))
 
 
+def stagger_crontabs(crontabs):
+    """Spreads the schedules repeating every k minutes (``*/k`` minute field)
+    over the k minutes: each one starts at an offset taken from a hash of its
+    key, instead of all at once. The offset of a crontab only depends on its
+    own key, adding or removing one leaves the others as they are. Takes and
+    returns a dictionary of crontabs.
+    """
+    staggered = dict(crontabs)
+    for key, crontab in crontabs.items():
+        fields = crontab.split()
+        match = re.match(r'^\*/(\d+)$', fields[0]) if len(fields) == 5 else None
+        if not match or not 1 < int(match.group(1)) < 60:
+            continue
+        period = int(match.group(1))
+        name = '/'.join(key) if isinstance(key, tuple) else str(key)
+        offset = int(hashlib.sha1(name.encode('utf8')).hexdigest(), 16) % period
+        if offset:
+            fields[0] = '{}-59/{}'.format(offset, period)
+            staggered[key] = ' '.join(fields)
+    return staggered
+
+
+@contextmanager
+def file_lock(lock_file, blocking=True):
+    """Holds an exclusive lock on *lock_file*, shared by all the processes of
+    the host. Without *blocking*, yields False instead of waiting when the lock
+    is held by another process.
+    """
+    os.makedirs(os.path.dirname(lock_file), exist_ok=True)
+    with open(lock_file, 'a') as f:
+        if fcntl is None:
+            yield True
+            return
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def lock_file(settings, name):
+    """The lock file of *name* in LOCKS_DIR: a service, held while its mirrors or its repository list change"""
+    return os.path.join(settings['LOCKS_DIR'], name + '.lock')
+
+
 def github_validator(name_or_repo: str):
     regex = re.compile(
         r'^([a-zA-Z\d](?:[a-zA-Z\d]|-(?=[a-zA-Z\d])){0,38})(\/[\w.-]{1,100})?$',
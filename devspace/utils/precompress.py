@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import gzip
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the files nginx would otherwise compress on every request
+COMPRESSIBLE = ('.html', '.htm', '.css', '.js', '.json', '.map', '.svg', '.txt', '.xml')
+# smaller files gain nothing from compression
+MIN_SIZE = 256
+# the siblings served by gzip_static and brotli_static
+SUFFIXES = ('.gz', '.br')
+
+
+def _encodings():
+    encodings = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0), gzip.decompress)]
+    if brotli is not None:
+        encodings.append(('.br', lambda data: brotli.compress(data, quality=11), brotli.decompress))
+    return encodings
+
+
+def load_record(record, path):
+    """The siblings under *path* listed in *record*, with the mtime they were given when written"""
+    try:
+        with open(record, 'r', encoding='utf8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {os.path.normpath(os.path.join(path, key)): mtime for key, mtime in data.items()}
+
+
+def _save_record(record, path, siblings):
+    os.makedirs(os.path.dirname(os.path.abspath(record)), exist_ok=True)
+    tmp_file = '{}.{}.tmp'.format(record, os.getpid())
+    with open(tmp_file, 'w', encoding='utf8') as f:
+        json.dump({os.path.relpath(sibling, path).replace('\\', '/'): mtime
+                   for sibling, mtime in siblings.items()}, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, record)
+
+
+def is_owned(sibling, owned):
+    """Whether *sibling* was written by precompress, as recorded in *owned*, and not replaced since"""
+    if sibling not in owned:
+        return False
+    try:
+        return os.stat(sibling).st_mtime_ns == owned[sibling]
+    except OSError:
+        return False
+
+
+def _is_fresh(path, sibling, st, decompress, digest):
+    """Whether *sibling* holds *path* compressed: it has the mtime of *path*, or the same content"""
+    try:
+        sibling_st = os.stat(sibling)
+    except OSError:
+        return False
+    if sibling_st.st_mtime_ns == st.st_mtime_ns:
+        return True
+    try:
+        with open(sibling, 'rb') as f:
+            same = hashlib.sha1(decompress(f.read())).digest() == digest()
+    except Exception:  # a corrupted sibling is written again
+        return False
+    if same:
+        os.utime(sibling, ns=(st.st_atime_ns, st.st_mtime_ns))
+    return same
+
+
+def compress_file(path, owned):
+    """
+    Write the compressed siblings of *path*, path.gz and path.br when brotli is
+    installed, with the mtime of *path*. Siblings of the same mtime or content
+    are kept. The siblings not in *owned*, published along with *path*, are
+    never replaced. Returns the number of siblings written and the siblings
+    now owned, with their mtime.
+    """
+    st = os.stat(path)
+    data = []
+    hashes = []
+
+    def read():
+        if not data:
+            with open(path, 'rb') as f:
+                data.append(f.read())
+        return data[0]
+
+    def digest():
+        if not hashes:
+            hashes.append(hashlib.sha1(read()).digest())
+        return hashes[0]
+
+    written = 0
+    siblings = {}
+    for suffix, compress, decompress in _encodings():
+        sibling = path + suffix
+        if os.path.exists(sibling) and not is_owned(sibling, owned):
+            # one holding the same content is taken over, any other one is left as it is
+            if _is_fresh(path, sibling, st, decompress, digest):
+                siblings[sibling] = st.st_mtime_ns
+            continue
+        if _is_fresh(path, sibling, st, decompress, digest):
+            siblings[sibling] = st.st_mtime_ns
+            continue
+        compressed = compress(read())
+        if len(compressed) >= len(read()):
+            continue
+        tmp_file = '{}.{}.tmp'.format(sibling, os.getpid())
+        with open(tmp_file, 'wb') as f:
+            f.write(compressed)
+        os.utime(tmp_file, ns=(st.st_atime_ns, st.st_mtime_ns))
+        os.replace(tmp_file, sibling)
+        siblings[sibling] = st.st_mtime_ns
+        written += 1
+    return written, siblings
+
+
+def _walk(path, exclude=()):
+    """Yield the compressible files under *path*, but the ones under the *exclude* directories of *path*"""
+    for root, dirs, files in os.walk(path):
+        if root == path:
+            dirs[:] = [name for name in dirs if name not in exclude]
+        for name in files:
+            full_path = os.path.join(root, name)
+            if name.lower().endswith(COMPRESSIBLE) and os.path.getsize(full_path) >= MIN_SIZE:
+                yield full_path
+
+
+def precompress(path, record, jobs=None, exclude=()):
+    """
+    Write the .gz siblings (and .br ones when brotli is installed) of the
+    text files under *path*, for gzip_static, on *jobs* threads. Only the
+    files whose siblings are missing or stale are compressed again. Returns
+    the number of siblings written.
+
+    The siblings written are listed in the *record* file. Only those are
+    replaced, or removed with their file, as long as they keep the mtime
+    they were given: a .gz or .br file published as it is never touched.
+    """
+    if not os.path.isdir(path):
+        return 0
+    path = os.path.normpath(path)
+    owned = load_record(record, path)
+    siblings = {}
+    written = 0
+    with ThreadPoolExecutor(max_workers=jobs or os.cpu_count() or 1) as executor:
+        for file_written, file_siblings in executor.map(lambda file: compress_file(file, owned),
+                                                        list(_walk(path, exclude))):
+            written += file_written
+            siblings.update(file_siblings)
+    # the siblings of the files removed, grown too small or no longer worth compressing
+    for sibling in set(owned) - set(siblings):
+        if is_owned(sibling, owned):
+            os.remove(sibling)
+    _save_record(record, path, siblings)
+    return written
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import filecmp
+import hashlib
+from os.path import join, isdir, normpath
+from devspace.utils.database import mirror_name
+
+# the directory of the per-section include files, next to the repository list
+SHARDS_SUFFIX = '.d'
+
+
+def _value(value):
+    # cgitrc values end at the end of the line
+    return ' '.join(str(value).split()) if value else ''
+
+
+def _shard_name(section):
+    if not section:
+        return 'default.repo'
+    slug = re.sub(r'[^A-Za-z0-9._-]+', '_', section)[:64]
+    return '{}-{}.repo'.format(slug, hashlib.sha1(section.encode('utf8')).hexdigest()[:8])
+
+
+def repo_list_writer(settings, service_name, conn):
+    """The writer of the cgit repository list of *service_name*, included by its cgitrc"""
+    data_dir = join(settings['SHARED_DATA'], service_name)
+    return RepoListWriter(conn, join(data_dir, service_name + '.repo'), data_dir, '/srv/git/' + service_name,
+                          int(settings.get('CGIT_REPO_SHARD_SIZE', 0)))
+
+
+def _replace(tmp_file, dst_file):
+    """Move *tmp_file* over *dst_file*, unless they are the same. Return whether it was replaced"""
+    if os.path.isfile(dst_file) and filecmp.cmp(tmp_file, dst_file, shallow=False):
+        os.remove(tmp_file)
+        return False
+    os.replace(tmp_file, dst_file)
+    return True
+
+
+class RepoListWriter:
+    """
+    Writes the cgit repository list of a GitMirror service, included by its
+    cgitrc, from the Repositories table of its database. Only the repositories
+    mirrored in *data_dir* are listed, with their path in the containers under
+    *git_root*.
+
+    The rows are streamed to the file in section order. With more than
+    *shard_size* repositories, each section goes to its own file in the
+    ``<list>.d`` directory and the list only includes them. Each file is
+    written aside and moved in place, cgit never reads a partial list.
+
+    The list is written again only when the version kept by the RepoList
+    triggers changed since the last time, or with *force*.
+    """
+
+    def __init__(self, conn, repo_file, data_dir, git_root, shard_size=0):
+        self.conn = conn
+        self.repo_file = repo_file
+        self.data_dir = normpath(data_dir)
+        self.git_root = git_root.rstrip('/')
+        self.shard_size = shard_size
+
+    def rows(self):
+        """Yield (section, name, owner, description) of the mirrored repositories, each mirror once"""
+        names = set()
+        for section, name, owner, description in self.conn.execute(
+                "SELECT coalesce(section, ''), name, owner, descriptions FROM Repositories "
+                "ORDER BY coalesce(section, ''), name, id"):
+            name = mirror_name(name)
+            path = normpath(join(self.data_dir, name + '.git'))
+            if path.startswith(self.data_dir + os.sep) and isdir(path) and name not in names:
+                names.add(name)
+                yield _value(section), name, owner, description
+
+    def entry(self, name, owner, description):
+        lines = ['repo.url={}'.format(name), 'repo.path={}/{}.git'.format(self.git_root, name)]
+        if owner:
+            lines.append('repo.owner={}'.format(_value(owner)))
+        if description:
+            lines.append('repo.desc={}'.format(_value(description)))
+        return '\n'.join(lines) + '\n\n'
+
+    def write_flat(self, f):
+        section = ''
+        for row_section, name, owner, description in self.rows():
+            if row_section != section:
+                section = row_section
+                f.write('section={}\n\n'.format(section))
+            f.write(self.entry(name, owner, description))
+
+    def write_shards(self, f):
+        """Write one file per section, include them in *f*. Return the names of the files"""
+        shards_dir = self.repo_file + SHARDS_SUFFIX
+        os.makedirs(shards_dir, exist_ok=True)
+        shards = []
+        shard = None
+        section = None
+        try:
+            for row_section, name, owner, description in self.rows():
+                if row_section != section:
+                    if shard:
+                        shard.close()
+                        _replace(shard.name, shard.name[:-len('.tmp')])
+                    section = row_section
+                    shards.append(_shard_name(section))
+                    shard = open(join(shards_dir, shards[-1] + '.tmp'), 'w', encoding='utf8')
+                    # the unsectioned repositories come first, they set no section
+                    if section:
+                        shard.write('section={}\n\n'.format(section))
+                    f.write('include={}/{}{}/{}\n'.format(self.git_root, os.path.basename(self.repo_file),
+                                                          SHARDS_SUFFIX, shards[-1]))
+                shard.write(self.entry(name, owner, description))
+        finally:
+            if shard:
+                shard.close()
+        if shard:
+            _replace(shard.name, shard.name[:-len('.tmp')])
+        return shards
+
+    def remove_shards(self, keep=()):
+        shards_dir = self.repo_file + SHARDS_SUFFIX
+        if not isdir(shards_dir):
+            return
+        for shard in os.listdir(shards_dir):
+            if shard not in keep:
+                os.remove(join(shards_dir, shard))
+        if not keep:
+            os.rmdir(shards_dir)
+
+    def write(self, force=False):
+        """Write the repository list when it changed, return whether it was written"""
+        version, written = self.conn.execute("SELECT version, written FROM RepoList").fetchone()
+        if version == written and not force and os.path.isfile(self.repo_file):
+            return False
+        count = sum(1 for _ in self.rows())
+        os.makedirs(os.path.dirname(self.repo_file), exist_ok=True)
+        tmp_file = self.repo_file + '.tmp'
+        shards = ()
+        with open(tmp_file, 'w', encoding='utf8') as f:
+            f.write('# generated by devspace from the Repositories table, do not edit\n\n')
+            if self.shard_size and count > self.shard_size:
+                shards = self.write_shards(f)
+            else:
+                self.write_flat(f)
+        _replace(tmp_file, self.repo_file)
+        # the shards no longer included are removed once the list is in place
+        self.remove_shards(shards)
+        with self.conn:
+            self.conn.execute("UPDATE RepoList SET written = ?", (version,))
+        return True
@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Compiles a JSON schema (the draft-07 subset used by project_schema.json)
+into a specialized Python validator module.
+
+Every sub-schema becomes a function, ``$ref`` are resolved at compile time
+into direct calls and regular expressions are compiled once at import. The
+generated ``validate(instance)`` collects all errors in one pass and reports
+the same messages as jsonschema.
+"""
+
+import os
+import sys
+import json
+import hashlib
+from importlib.util import spec_from_file_location, module_from_spec
+
+# bump when the generated code changes, so cached validators are regenerated
+COMPILER_VERSION = 1
+
+IGNORED_KEYWORDS = {'$schema', '$id', '$comment', 'title', 'description', 'default', 'examples', 'definitions',
+                    'format'}
+TYPE_CHECKS = {
+    'object': "isinstance({0}, dict)",
+    'array': "isinstance({0}, list)",
+    'string': "isinstance({0}, str)",
+    'boolean': "isinstance({0}, bool)",
+    'null': "{0} is None",
+    'number': "(isinstance({0}, (int, float)) and not isinstance({0}, bool))",
+    'integer': "((isinstance({0}, int) and not isinstance({0}, bool)) or "
+               "(isinstance({0}, float) and {0}.is_integer()))",
+}
+
+HEADER = '''# -*- coding: utf-8 -*-
+# Generated by devspace.utils.schema from {source}, do not edit.
+
+import re
+
+
+def _unbool(element, true=object(), false=object()):
+    if element is True:
+        return true
+    elif element is False:
+        return false
+    return element
+
+
+def _uniq(container):
+    try:
+        return len(set(_unbool(i) for i in container)) == len(container)
+    except TypeError:
+        seen = []
+        for element in container:
+            element = _unbool(element)
+            if element in seen:
+                return False
+            seen.append(element)
+        return True
+
+
+def _in_enum(instance, enums):
+    if instance == 0 or instance == 1:
+        unbooled = _unbool(instance)
+        return any(unbooled == _unbool(each) for each in enums)
+    return instance in enums
+
+
+def _extras_msg(extras):
+    return ", ".join(repr(extra) for extra in extras), "was" if len(extras) == 1 else "were"
+
+
+def _errors_of(function, instance):
+    errors = []
+    function(instance, (), errors)
+    return errors
+
+
+def validate(instance):
+    """Returns the list of (path, message) errors of *instance*, empty when valid"""
+    errors = []
+    {root}(instance, (), errors)
+    return errors
+
+'''
+
+
+class SchemaCompileError(Exception):
+    """The schema uses a keyword the compiler does not support"""
+
+
+class _Compiler:
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.functions = {}
+        self.pending = []
+        self.constants = []
+        self.regexes = {}
+        self.code = []
+
+    def constant(self, value):
+        name = '_C%d' % len(self.constants)
+        if isinstance(value, (set, frozenset)):
+            self.constants.append('%s = frozenset(%r)' % (name, sorted(value)))
+        else:
+            self.constants.append('%s = %r' % (name, value))
+        return name
+
+    def regex(self, pattern):
+        if pattern not in self.regexes:
+            name = '_RE%d' % len(self.regexes)
+            self.regexes[pattern] = name
+            self.constants.append('%s = re.compile(%r)' % (name, pattern))
+        return self.regexes[pattern]
+
+    def resolve(self, ref):
+        if not ref.startswith('#'):
+            raise SchemaCompileError("Remote $ref not supported: %s" % ref)
+        node = self.schema
+        for part in ref[1:].split('/')[1:]:
+            part = part.replace('~1', '/').replace('~0', '~')
+            node = node[int(part)] if isinstance(node, list) else node[part]
+        return node
+
+    def function(self, node):
+        """Name of the function validating *node*, refs are followed at compile time"""
+        while isinstance(node, dict) and '$ref' in node:
+            # in draft-07, keywords next to $ref are ignored
+            node = self.resolve(node['$ref'])
+        key = id(node)
+        if key not in self.functions:
+            self.functions[key] = '_validate_%d' % len(self.functions)
+            self.pending.append((self.functions[key], node))
+        return self.functions[key]
+
+    def compile(self, pointer='#'):
+        root = self.function(self.resolve(pointer))
+        while self.pending:
+            name, node = self.pending.pop(0)
+            self.code.append(self.compile_function(name, node))
+        return root
+
+    def compile_function(self, name, node):
+        lines = ['def %s(instance, path, errors):' % name]
+        if node is True or node == {}:
+            lines.append('    return')
+            return '\n'.join(lines)
+        if node is False:
+            lines.append('    errors.append((path, "False schema does not allow %r" % (instance,)))')
+            return '\n'.join(lines)
+        unsupported = set(node) - IGNORED_KEYWORDS - {
+            'type', 'enum', 'properties', 'patternProperties', 'additionalProperties', 'required', 'items',
+            'pattern', 'minLength', 'maxLength', 'minimum', 'maximum', 'minItems', 'maxItems', 'uniqueItems',
+            'allOf', 'anyOf', 'oneOf'}
+        if unsupported:
+            raise SchemaCompileError("Keywords not supported: %s" % ', '.join(sorted(unsupported)))
+
+        if 'type' in node:
+            types = node['type'] if isinstance(node['type'], list) else [node['type']]
+            check = ' or '.join(TYPE_CHECKS[t].format('instance') for t in types)
+            message = ', '.join(repr(t) for t in types)
+            lines += ['    if not (%s):' % check,
+                      '        errors.append((path, "%%r is not of type %%s" %% (instance, %r)))' % message]
+        if 'enum' in node:
+            enums = self.constant(node['enum'])
+            lines += ['    if not _in_enum(instance, %s):' % enums,
+                      '        errors.append((path, "%%r is not one of %%r" %% (instance, %s)))' % enums]
+        lines += self.compile_object(node)
+        lines += self.compile_array(node)
+        lines += self.compile_string(node)
+        lines += self.compile_number(node)
+        lines += self.compile_combinators(node)
+        if len(lines) == 1:
+            lines.append('    return')
+        return '\n'.join(lines)
+
+    def compile_object(self, node):
+        body = []
+        for prop in node.get('required', []):
+            body += ['if %r not in instance:' % prop,
+                     '    errors.append((path, "%%r is a required property" %% %r))' % prop]
+        properties = node.get('properties', {})
+        for prop, subschema in properties.items():
+            body += ['if %r in instance:' % prop,
+                     '    %s(instance[%r], path + (%r,), errors)' % (self.function(subschema), prop, prop)]
+        patterns = node.get('patternProperties', {})
+        additional = node.get('additionalProperties', True)
+        if patterns or additional is not True:
+            known = self.constant(frozenset(properties))
+            body += ['extras = []',
+                     'for key, value in instance.items():',
+                     '    matched = key in %s' % known]
+            for pattern, subschema in patterns.items():
+                body += ['    if %s.search(key):' % self.regex(pattern),
+                         '        matched = True',
+                         '        %s(value, path + (key,), errors)' % self.function(subschema)]
+            body += ['    if not matched:',
+                     '        extras.append(key)']
+            if additional is False:
+                if patterns:
+                    verbose = ', '.join(repr(p) for p in sorted(patterns))
+                    body += ['if extras:',
+                             '    errors.append((path, "%%s %%s not match any of the regexes: %%s" %% ('
+                             '", ".join(map(repr, sorted(extras))), "does" if len(extras) == 1 else "do", %r)))'
+                             % verbose]
+                else:
+                    body += ['if extras:',
+                             '    errors.append((path, "Additional properties are not allowed (%s %s unexpected)"'
+                             ' % _extras_msg(extras)))']
+            elif isinstance(additional, dict):
+                body += ['for key in extras:',
+                         '    %s(instance[key], path + (key,), errors)' % self.function(additional)]
+        return self.guard('isinstance(instance, dict)', body)
+
+    def compile_array(self, node):
+        body = []
+        if 'minItems' in node:
+            body += ['if len(instance) < %d:' % node['minItems'],
+                     '    errors.append((path, "%r is too short" % (instance,)))']
+        if 'maxItems' in node:
+            body += ['if len(instance) > %d:' % node['maxItems'],
+                     '    errors.append((path, "%r is too long" % (instance,)))']
+        if node.get('uniqueItems'):
+            body += ['if not _uniq(instance):',
+                     '    errors.append((path, "%r has non-unique elements" % (instance,)))']
+        if 'items' in node:
+            items = node['items']
+            if isinstance(items, list):
+                for index, subschema in enumerate(items):
+                    body += ['if len(instance) > %d:' % index,
+                             '    %s(instance[%d], path + (%d,), errors)' % (self.function(subschema), index, index)]
+            else:
+                body += ['for index, item in enumerate(instance):',
+                         '    %s(item, path + (index,), errors)' % self.function(items)]
+        return self.guard('isinstance(instance, list)', body)
+
+    def compile_string(self, node):
+        body = []
+        if 'minLength' in node:
+            body += ['if len(instance) < %d:' % node['minLength'],
+                     '    errors.append((path, "%r is too short" % (instance,)))']
+        if 'maxLength' in node:
+            body += ['if len(instance) > %d:' % node['maxLength'],
+                     '    errors.append((path, "%r is too long" % (instance,)))']
+        if 'pattern' in node:
+            body += ['if not %s.search(instance):' % self.regex(node['pattern']),
+                     '    errors.append((path, "%%r does not match %%r" %% (instance, %r)))' % node['pattern']]
+        return self.guard('isinstance(instance, str)', body)
+
+    def compile_number(self, node):
+        body = []
+        if 'minimum' in node:
+            body += ['if instance < %r:' % node['minimum'],
+                     '    errors.append((path, "%%r is less than the minimum of %%r" %% (instance, %r)))'
+                     % node['minimum']]
+        if 'maximum' in node:
+            body += ['if instance > %r:' % node['maximum'],
+                     '    errors.append((path, "%%r is greater than the maximum of %%r" %% (instance, %r)))'
+                     % node['maximum']]
+        return self.guard(TYPE_CHECKS['number'].format('instance'), body)
+
+    def compile_combinators(self, node):
+        lines = []
+        for subschema in node.get('allOf', []):
+            lines.append('    %s(instance, path, errors)' % self.function(subschema))
+        for keyword in ('anyOf', 'oneOf'):
+            if keyword not in node:
+                continue
+            functions = ', '.join(self.function(subschema) for subschema in node[keyword]) + ','
+            lines += ['    valid = [function for function in (%s) if not _errors_of(function, instance)]'
+                      % functions,
+                      '    if not valid:',
+                      '        errors.append((path, "%r is not valid under any of the given schemas" % (instance,)))']
+            if keyword == 'oneOf':
+                reprs = self.constant({self.function(s): repr(s) for s in node[keyword]})
+                lines += ['    elif len(valid) > 1:',
+                          '        errors.append((path, "%%r is valid under each of %%s" %% '
+                          '(instance, ", ".join(%s[function.__name__] for function in valid))))' % reprs]
+        return lines
+
+    @staticmethod
+    def guard(condition, body):
+        if not body:
+            return []
+        return ['    if %s:' % condition] + ['        ' + line for line in body]
+
+
+def compile_schema(schema, source='schema', pointer='#'):
+    """Returns the source code of a validator module for *schema*, or for
+    its sub-schema at the JSON pointer *pointer*.
+    """
+    compiler = _Compiler(schema)
+    root = compiler.compile(pointer)
+    return HEADER.format(source=source, root=root) + '\n' + '\n'.join(compiler.constants) + '\n\n\n' + \
+        '\n\n\n'.join(compiler.code) + '\n'
+
+
+def load_validator(schema_file, cache_dir, pointer='#'):
+    """Imports the validator compiled from *schema_file* (or from its sub-schema
+    at *pointer*), generating it into *cache_dir* when the schema changed.
+    Returns None when the schema cannot be compiled.
+    """
+    with open(schema_file, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw + '{}:{}'.format(COMPILER_VERSION, pointer).encode()).hexdigest()[:16]
+    module_name = '{}_{}'.format(os.path.splitext(os.path.basename(schema_file))[0], digest)
+    module_file = os.path.join(cache_dir, module_name + '.py')
+    if not os.path.isfile(module_file):
+        try:
+            code = compile_schema(json.loads(raw.decode('utf-8')), os.path.basename(schema_file), pointer)
+        except SchemaCompileError:
+            return None
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_file = '{}.{}.tmp'.format(module_file, os.getpid())
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(code)
+            os.replace(tmp_file, module_file)
+        except OSError:
+            # cache not writable, use the validator without keeping it
+            module = type(sys)(module_name)
+            exec(compile(code, module_file, 'exec'), module.__dict__)
+            return module
+    spec = spec_from_file_location(module_name, module_file)
+    module = module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def format_path(path):
+    return '/'.join(str(part) for part in path)
+
+
+if __name__ == '__main__':
+    # build step: python -m devspace.utils.schema <schema.json> [output.py]
+    with open(sys.argv[1], 'r', encoding='utf-8') as f:
+        output = compile_schema(json.load(f), os.path.basename(sys.argv[1]))
+    if len(sys.argv) > 2:
+        with open(sys.argv[2], 'w', encoding='utf-8') as f:
+            f.write(output)
+    else:
+        print(output)
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os
+import string
+import threading
+from collections import ChainMap
+from functools import lru_cache
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+
+class CompiledTemplate:
+    """
+    A string.Template parsed once into literal text and placeholders.
+
+    Rendering only fills the placeholder slots and joins the parts, with the
+    same result as string.Template.safe_substitute: unknown placeholders and
+    invalid ``$`` sequences are left as they are, ``$$`` becomes ``$``.
+    """
+
+    pattern = string.Template.pattern
+
+    def __init__(self, source):
+        self.source = source
+        self._parts = []
+        self._slots = []
+        position = 0
+        for match in self.pattern.finditer(source):
+            self._parts.append(source[position:match.start()])
+            name = match.group('named') or match.group('braced')
+            if name is not None:
+                self._slots.append((len(self._parts), name, match.group()))
+                self._parts.append(match.group())
+            elif match.group('escaped') is not None:
+                self._parts.append(match.group('escaped'))
+            else:
+                self._parts.append(match.group())
+            position = match.end()
+        self._parts.append(source[position:])
+
+    def safe_substitute(self, mapping=None, **kwargs):
+        if mapping is None:
+            mapping = kwargs
+        elif kwargs:
+            mapping = ChainMap(kwargs, mapping)
+        parts = self._parts[:]
+        for index, name, placeholder in self._slots:
+            if name in mapping:
+                parts[index] = str(mapping[name])
+        return ''.join(parts)
+
+
+@lru_cache(maxsize=1024)
+def compile_template(source):
+    return CompiledTemplate(source)
+
+
+def get_template(path):
+    """Return the compiled template of *path*, parsed once per process
+    and again only when the file changes.
+    """
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    entry = _cache.get(path)
+    if entry is not None and entry[0] == key:
+        return entry[1]
+    with open(path, 'rb') as fp:
+        template = CompiledTemplate(fp.read().decode('utf8'))
+    with _cache_lock:
+        _cache[path] = (key, template)
+    return template
@@ -0,0 +1,25 @@
+from devspace.utils.misc import stagger_crontabs
+
+
+def test_stagger_crontabs_within_period():
+    crontabs = {('GitMirror', 'service%d' % i): '*/10 * * * *' for i in range(20)}
+    for crontab in stagger_crontabs(crontabs).values():
+        minute = crontab.split()[0]
+        assert minute == '*/10' or (minute.endswith('-59/10') and 0 < int(minute.split('-')[0]) < 10)
+
+
+def test_stagger_crontabs_keeps_other_schedules():
+    crontabs = {('GitMirror', 'daily'): '0 3 * * *', ('GitMirror', 'hourly'): '*/60 * * * *'}
+    assert stagger_crontabs(crontabs) == crontabs
+
+
+def test_stagger_crontabs_adding_a_service_keeps_the_others():
+    crontabs = {('GitMirror', 'github'): '*/10 * * * *', ('GitMirror', 'gitee'): '*/10 * * * *',
+                ('DocBuilder', 'note'): '*/15 * * * *'}
+    staggered = stagger_crontabs(crontabs)
+    crontabs[('GitMirror', 'yocto')] = '*/10 * * * *'
+    added = stagger_crontabs(crontabs)
+    assert {key: added[key] for key in staggered} == staggered
+    del crontabs[('GitMirror', 'gitee')]
+    removed = stagger_crontabs(crontabs)
+    assert all(removed[key] == staggered[key] for key in removed if key in staggered)
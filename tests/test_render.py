@@ -0,0 +1,61 @@
+import json
+import os
+
+from devspace.settings import Settings
+from devspace.servers.web import Web
+
+EXAMPLE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'devspace', 'templates', 'example')
+
+
+def cgit_service(name, title):
+    return {'Web': {'cgit_options': {
+        'title': title, 'description': '', 'max-repo-count': 50,
+        'logo': {theme: os.path.join(EXAMPLE_DIR, '{}-logo-{}.png'.format(name, theme)) for theme in ('light', 'dark')},
+    }}}
+
+
+def project_settings(project_dir, services):
+    settings = Settings()
+    settings.set('PRECOMPRESS', False)
+    settings.set_dict({
+        'version': '1.0',
+        'maintainer': 'yang <a@b>',
+        'project': {'name': 'demo', 'path': str(project_dir)},
+        'servers': {'Web': {'host': '192.0.2.2', 'port': 8888, 'type': 'alpine', 'localization': True}},
+        'services': services,
+    })
+    return settings
+
+
+def render(project_dir, services, changed=False):
+    server = Web(project_settings(project_dir, json.loads(json.dumps(services))))
+    server.render(changed)
+    return server.manifest
+
+
+def test_changed_renders_the_changed_service_only(tmp_path):
+    services = {'yocto': cgit_service('yocto', 'Yocto'), 'github': cgit_service('github', 'GitHub')}
+    render(tmp_path, services)
+    before = {path: os.stat(str(path)).st_mtime_ns for path in tmp_path.rglob('*') if path.is_file()}
+
+    services['github']['Web']['cgit_options']['title'] = 'GitHub mirrors'
+    manifest = render(tmp_path, services, changed=True)
+
+    assert manifest.summary().startswith('Web: 1 written, ')
+    assert manifest.removed == 0
+    written = sorted(str(path.relative_to(tmp_path)) for path in tmp_path.rglob('*')
+                     if path.is_file() and before.get(path) != os.stat(str(path)).st_mtime_ns)
+    # the render manifest itself is saved again
+    assert written == ['.devspace/render-manifest.json', 'servers/Web/config/cgit/github.cgit.com']
+
+
+def test_changed_skips_the_other_services(tmp_path):
+    services = {'yocto': cgit_service('yocto', 'Yocto'), 'github': cgit_service('github', 'GitHub')}
+    render(tmp_path, services)
+    full = render(tmp_path, services)
+    services['github']['Web']['cgit_options']['title'] = 'GitHub mirrors'
+    manifest = render(tmp_path, services, changed=True)
+    # the outputs of yocto are neither written nor rendered again, only kept in the manifest
+    assert manifest.written + manifest.skipped < full.written + full.skipped
+    assert 'servers/Web/config/cgit/yocto.cgit.com' in manifest.outputs
+    assert 'servers/Web/config/nginx/yocto.cgit.com' in manifest.outputs